@@ -0,0 +1,138 @@
+import numpy as np
+import xarray as xr
+import rioxarray  # registers the .rio accessor
+import geopandas as gpd
+import rasterio
+from rasterio.windows import Window
+from affine import Affine
+
+
+def nearest_index(src, dst):
+    """
+    For every coordinate in dst return the index of the nearest coordinate in src, or -1 when
+    it falls more than half a source pixel outside src. src must be regularly spaced.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    index = np.full(dst.shape, -1, dtype=np.int64)
+    if src.size == 0:
+        return index
+    descending = src.size > 1 and src[0] > src[-1]
+    ordered = src[::-1] if descending else src
+    half_pixel = abs(ordered[1] - ordered[0]) / 2 if ordered.size > 1 else 50.0
+
+    position = np.clip(np.searchsorted(ordered, dst), 1, max(ordered.size - 1, 1))
+    left = np.clip(position - 1, 0, ordered.size - 1)
+    right = np.clip(position, 0, ordered.size - 1)
+    nearest = np.where(np.abs(dst - ordered[left]) <= np.abs(ordered[right] - dst), left, right)
+    inside = np.abs(ordered[nearest] - dst) <= half_pixel
+    if descending:
+        nearest = ordered.size - 1 - nearest
+    index[inside] = nearest[inside]
+    return index
+
+
+class AOIGrid:
+    """
+    Fixed north-up grid covering the AOI, snapped to whole multiples of the resolution.
+    x holds the ascending and y the descending pixel-centre coordinates.
+    """
+
+    def __init__(self, x, y, crs):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.crs = crs
+        self.resolution = abs(self.x[1] - self.x[0]) if self.x.size > 1 else 100.0
+
+    @classmethod
+    def from_geojson(cls, geojson_file, crs="EPSG:32645", resolution=100.0):
+        """
+        Build the grid covering the bounding box of a GeoJSON in the given CRS.
+        """
+        minx, miny, maxx, maxy = gpd.read_file(geojson_file).to_crs(crs).total_bounds
+        minx = np.floor(minx / resolution) * resolution
+        miny = np.floor(miny / resolution) * resolution
+        maxx = np.ceil(maxx / resolution) * resolution
+        maxy = np.ceil(maxy / resolution) * resolution
+        x = np.arange(minx + resolution / 2, maxx, resolution)
+        y = np.arange(maxy - resolution / 2, miny, -resolution)
+        return cls(x, y, crs)
+
+    @property
+    def shape(self):
+        return self.y.size, self.x.size
+
+    @property
+    def size(self):
+        return self.y.size * self.x.size
+
+    @property
+    def transform(self):
+        return Affine(self.resolution, 0.0, self.x[0] - self.resolution / 2,
+                      0.0, -self.resolution, self.y[0] + self.resolution / 2)
+
+    def resample(self, data):
+        """
+        Nearest-neighbour resample a 2-D (y, x) DataArray in the grid's CRS onto the grid.
+        Returns the flat grid indices and float32 values of the valid pixels only, so a granule
+        that covers a small part of the AOI stays small in memory.
+        """
+        cols = nearest_index(data['x'].values, self.x)
+        rows = nearest_index(data['y'].values, self.y)
+        grid_cols = np.flatnonzero(cols >= 0)
+        grid_rows = np.flatnonzero(rows >= 0)
+        if grid_cols.size == 0 or grid_rows.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Read only the part of the source that falls on the grid, so a lazily opened file
+        # decodes just the chunks it needs
+        src_rows = rows[grid_rows]
+        src_cols = cols[grid_cols]
+        row0, col0 = src_rows.min(), src_cols.min()
+        window = data.transpose('y', 'x').isel(y=slice(row0, src_rows.max() + 1), x=slice(col0, src_cols.max() + 1))
+        values = np.asarray(window.values, dtype=np.float32)[np.ix_(src_rows - row0, src_cols - col0)]
+        flat_index = (grid_rows[:, None] * self.x.size + grid_cols[None, :]).ravel()
+        values = values.ravel()
+        valid = ~np.isnan(values)
+        return flat_index[valid], values[valid]
+
+    def to_dataarray(self, array, name='wse', crop=True, origin=(0, 0)):
+        """
+        Wrap a full-grid array, or a 2-D window of the grid starting at origin (row, col), as a
+        georeferenced DataArray, cropped to its valid pixels by default.
+        """
+        array = np.asarray(array)
+        if array.ndim == 1:
+            array = array.reshape(self.shape)
+        row0, col0 = origin
+        data = xr.DataArray(array, dims=('y', 'x'), name=name,
+                            coords={'y': self.y[row0:row0 + array.shape[0]], 'x': self.x[col0:col0 + array.shape[1]]})
+        if crop:
+            valid = ~np.isnan(array)
+            rows = np.flatnonzero(valid.any(axis=1))
+            cols = np.flatnonzero(valid.any(axis=0))
+            if rows.size and cols.size:
+                data = data.isel(y=slice(rows[0], rows[-1] + 1), x=slice(cols[0], cols[-1] + 1))
+        return data.rio.write_crs(self.crs)
+
+    def write_raster(self, path, layers, compress='deflate', block_size=256):
+        """
+        Write DataArrays on this grid (e.g. the blocks of a composite) into one tiled float32
+        GeoTIFF over their combined extent, window by window; the rest of it is NaN.
+        """
+        windows = []
+        for data in layers:
+            row0 = int(round((self.y[0] - float(data['y'][0])) / self.resolution))
+            col0 = int(round((float(data['x'][0]) - self.x[0]) / self.resolution))
+            windows.append((row0, col0, data))
+        row_min = min(row0 for row0, col0, data in windows)
+        col_min = min(col0 for row0, col0, data in windows)
+        height = max(row0 + data.sizes['y'] for row0, col0, data in windows) - row_min
+        width = max(col0 + data.sizes['x'] for row0, col0, data in windows) - col_min
+        profile = dict(driver='GTiff', height=height, width=width, count=1, dtype='float32', crs=self.crs,
+                       transform=self.transform * Affine.translation(col_min, row_min), nodata=np.nan,
+                       tiled=True, blockxsize=block_size, blockysize=block_size, compress=compress)
+        with rasterio.open(path, 'w', **profile) as dst:
+            for row0, col0, data in windows:
+                dst.write(data.values.astype(np.float32), 1,
+                          window=Window(col0 - col_min, row0 - row_min, data.sizes['x'], data.sizes['y']))
@@ -0,0 +1,270 @@
+"""
+Disk-backed OpenStreetMap basemap for the rendering scripts.
+
+Tiles are kept in a size-bounded LRU cache on disk, so each zoom-10 tile of the fixed map
+extent is fetched once instead of once per figure. The basemap can also be pre-rendered once
+for the fixed extent as a georeferenced PNG, after which figures need no network at all:
+
+    python Basemap_Cache.py --prerender
+"""
+import io
+import os
+import json
+import argparse
+import threading
+import numpy as np
+from urllib.request import Request, urlopen
+from PIL import Image
+import cartopy
+import cartopy.crs as ccrs
+import cartopy.io.img_tiles as cimgt
+
+basemap_cache_dir = '../Basemap_Cache/'
+prerendered_basemap = os.path.join(basemap_cache_dir, 'basemap_z10.png')
+map_extent = [89.6896, 96.1684, 17.0045, 25.7795]
+
+
+class CachedOSM(cimgt.OSM):
+    """
+    OSM tiles cached on disk as {z}/{x}/{y}.png, evicting the least recently used tiles once the
+    cache grows past max_bytes. With offline=True missing tiles are drawn blank instead of fetched.
+    url_template (with {x}, {y} and {z}) points the tiler at another tile server, e.g. a local one.
+    Render workers share the folder, so a tile may disappear at any time; it is then fetched again.
+    """
+
+    def __init__(self, cache_dir=basemap_cache_dir, max_bytes=500 * 1024 ** 2, url_template=None, offline=False,
+                 user_agent=f'CartoPy/{cartopy.__version__}'):
+        super().__init__(user_agent=user_agent)
+        self.cache_dir = os.path.join(cache_dir, 'tiles')
+        self.max_bytes = max_bytes
+        self.url_template = url_template
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.cache_bytes = sum(size for mtime, size, path in self.tile_stats())
+        if self.cache_bytes > self.max_bytes:
+            # The limit may be lower than in earlier runs
+            self.evict()
+
+    def _image_url(self, tile):
+        if self.url_template is None:
+            return super()._image_url(tile)
+        x, y, z = tile
+        return self.url_template.format(x=x, y=y, z=z)
+
+    def tile_path(self, tile):
+        x, y, z = tile
+        return os.path.join(self.cache_dir, str(z), str(x), f'{y}.png')
+
+    def cached_tiles(self):
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith('.png'):
+                    yield os.path.join(root, file)
+
+    def tile_stats(self):
+        """
+        (mtime, size, path) of the cached tiles, leaving out tiles removed by another process meanwhile.
+        """
+        for path in self.cached_tiles():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """
+        Delete the least recently used tiles until the cache fits in max_bytes.
+        """
+        tiles = sorted(self.tile_stats())
+        # Other processes add and remove tiles too, so start from what is on disk now
+        self.cache_bytes = sum(size for mtime, size, path in tiles)
+        for mtime, size, path in tiles:
+            if self.cache_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.cache_bytes -= size
+
+    def cached_image(self, path):
+        """
+        The cached tile at path, or None if it is not (or no longer) in the cache.
+        """
+        try:
+            # Touch the tile so eviction sees it as recently used
+            os.utime(path)
+            img = Image.open(path)
+            img.load()
+        except FileNotFoundError:
+            return None
+        return img
+
+    def fetch(self, tile):
+        request = Request(self._image_url(tile), headers={"User-Agent": self.user_agent})
+        with urlopen(request, timeout=30) as response:
+            return response.read()
+
+    def get_image(self, tile):
+        path = self.tile_path(tile)
+        img = self.cached_image(path)
+        if img is None and self.offline:
+            img = Image.fromarray(np.full((256, 256, 3), (250, 250, 250), dtype=np.uint8))
+        elif img is None:
+            try:
+                data = self.fetch(tile)
+            except Exception as e:
+                print(f"Error fetching tile {tile}: {e}")
+                img = Image.fromarray(np.full((256, 256, 3), (250, 250, 250), dtype=np.uint8))
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                with self.lock:
+                    self.cache_bytes += len(data)
+                    if self.cache_bytes > self.max_bytes:
+                        self.evict()
+                img = Image.open(io.BytesIO(data))
+
+        img = img.convert(self.desired_tile_form or 'RGB')
+        return img, self.tileextent(tile), 'lower'
+
+
+def prerender_basemap(tiler, extent=map_extent, zoom=10, image_path=prerendered_basemap, width=None):
+    """
+    Render the basemap for a fixed lon/lat extent once and save it as a PNG with a JSON sidecar
+    holding the extent and a world file (.pgw), so it is georeferenced for other tools too.
+    By default the width matches the native resolution of the tiles at this zoom.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    lon_span = extent[1] - extent[0]
+    lat_span = extent[3] - extent[2]
+    if width is None:
+        width = int(np.ceil(256 * 2 ** zoom * lon_span / 360))
+    height = int(round(width * lat_span / lon_span))
+
+    fig = plt.figure(figsize=(width / 100, height / 100), dpi=100)
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    ax.add_image(tiler, zoom)
+    ax.set_axis_off()
+    os.makedirs(os.path.dirname(image_path) or '.', exist_ok=True)
+    fig.savefig(image_path, dpi=100)
+    plt.close(fig)
+
+    with open(f"{os.path.splitext(image_path)[0]}.json", 'w') as f:
+        json.dump({'extent': list(extent), 'zoom': zoom, 'crs': 'EPSG:4326'}, f)
+    pixel_x = lon_span / width
+    pixel_y = lat_span / height
+    with open(f"{os.path.splitext(image_path)[0]}.pgw", 'w') as f:
+        f.write(f"{pixel_x}\n0.0\n0.0\n{-pixel_y}\n{extent[0] + pixel_x / 2}\n{extent[3] - pixel_y / 2}\n")
+    return image_path
+
+
+def add_basemap(ax, zoom=10, image_path=prerendered_basemap, cache_dir=basemap_cache_dir, offline=False):
+    """
+    Draw the OSM basemap on a PlateCarree GeoAxes: the pre-rendered image if there is one,
+    otherwise tiles from the disk cache.
+    """
+    extent_path = f"{os.path.splitext(image_path)[0]}.json"
+    if os.path.exists(image_path) and os.path.exists(extent_path):
+        with open(extent_path) as f:
+            extent = json.load(f)['extent']
+        img = Image.open(image_path).convert('RGB')
+        return ax.imshow(np.asarray(img), origin='upper', extent=extent, transform=ccrs.PlateCarree(),
+                         interpolation='bilinear', zorder=0)
+    return ax.add_image(CachedOSM(cache_dir, offline=offline), zoom)
+
+
+def open_and_evict(cache_dir, max_bytes):
+    return CachedOSM(cache_dir, max_bytes=max_bytes).cache_bytes
+
+
+def check_cache(rounds=10, workers=4):
+    """
+    Check the tile cache against a local stand-in tile server: tiles are fetched once through
+    url_template, offline mode serves cached tiles and draws missing ones blank without a request,
+    and render workers opening an oversized cache at the same time all evict without errors.
+    """
+    import shutil
+    import tempfile
+    import http.server
+    from concurrent.futures import ProcessPoolExecutor
+
+    requests = []
+
+    class TileHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            z, x, y = (int(part) for part in self.path.strip('/').removesuffix('.png').split('/'))
+            requests.append((x, y, z))
+            buffer = io.BytesIO()
+            Image.fromarray(np.full((256, 256, 3), (x % 256, y % 256, z), dtype=np.uint8)).save(buffer, 'PNG')
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(buffer.tell()))
+            self.end_headers()
+            self.wfile.write(buffer.getvalue())
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), TileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cache_dir = tempfile.mkdtemp(prefix='basemap_cache_')
+    url_template = f'http://127.0.0.1:{server.server_port}/{{z}}/{{x}}/{{y}}.png'
+    try:
+        tiles = [(x, y, 10) for x in range(750, 756) for y in range(440, 446)]
+        tiler = CachedOSM(cache_dir, url_template=url_template)
+        for tile in tiles + tiles:
+            img, extent, origin = tiler.get_image(tile)
+            assert np.asarray(img)[0, 0].tolist() == [tile[0] % 256, tile[1] % 256, tile[2]]
+        assert sorted(requests) == sorted(tiles), "every tile is fetched exactly once"
+        print(f"url_template: {len(tiles)} tiles fetched once, {len(tiles)} served from the cache")
+
+        offline = CachedOSM(cache_dir, url_template=url_template, offline=True)
+        assert np.asarray(offline.get_image(tiles[0])[0])[0, 0].tolist() == [750 % 256, 440 % 256, 10]
+        assert np.asarray(offline.get_image((0, 0, 10))[0])[0, 0].tolist() == [250, 250, 250]
+        assert len(requests) == len(tiles), "offline mode sends no requests"
+        print("offline: cached tiles served, a missing tile drawn blank, no requests")
+
+        tile_bytes = tiler.cache_bytes // len(tiles)
+        with ProcessPoolExecutor(workers) as pool:
+            for limit in np.linspace(len(tiles), 0, rounds).astype(int):
+                sizes = list(pool.map(open_and_evict, [cache_dir] * workers, [int(limit) * tile_bytes] * workers))
+                assert max(sizes) <= limit * tile_bytes
+        assert not list(tiler.cached_tiles())
+        print(f"{workers} workers evicted the shared cache in {rounds} rounds without errors")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prerender', action='store_true', help="Render the basemap for the fixed map extent.")
+    parser.add_argument('--zoom', type=int, default=10, help="Tile zoom level.")
+    parser.add_argument('--cache-dir', default=basemap_cache_dir, help="Folder of the tile cache.")
+    parser.add_argument('--max-mb', type=float, default=500, help="Size limit of the tile cache in MB.")
+    parser.add_argument('--url-template', default=None, help="Tile server URL with {x}, {y} and {z}.")
+    parser.add_argument('--check', action='store_true',
+                        help="Check the cache against a local stand-in tile server and exit.")
+    args = parser.parse_args()
+
+    if args.check:
+        check_cache()
+        raise SystemExit
+
+    tiler = CachedOSM(args.cache_dir, max_bytes=int(args.max_mb * 1024 ** 2), url_template=args.url_template)
+    if args.prerender:
+        path = prerender_basemap(tiler, zoom=args.zoom,
+                                 image_path=os.path.join(args.cache_dir, f'basemap_z{args.zoom}.png'))
+        print(f"Saved the pre-rendered basemap to {path}")
+    print(f"Tile cache: {tiler.cache_bytes / 1024 ** 2:.1f} MB in {args.cache_dir}")
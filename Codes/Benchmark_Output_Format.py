@@ -0,0 +1,61 @@
+"""
+Benchmark the output encodings of Output_Format.py on synthetic SWOT-like rasters and report the
+size on disk, write time, full read time, window read time and largest error of each one.
+
+    python Benchmark_Output_Format.py --files 5 --size 2000
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from Output_Format import write_wse, open_wse, path_size
+from Synthetic_SWOT import filtered_dataset
+
+encodings = {
+    'uncompressed': dict(store='netcdf', compression='none'),
+    'zlib float32': dict(store='netcdf', compression='zlib'),
+    'zstd float32': dict(store='netcdf', compression='zstd'),
+    'zlib int16': dict(store='netcdf', compression='zlib', dtype='int16'),
+    'zstd int16': dict(store='netcdf', compression='zstd', dtype='int16'),
+    'zarr float32': dict(store='zarr'),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5, help="Synthetic rasters per encoding.")
+    parser.add_argument('--size', type=int, default=2000, help="Pixels per side of each raster.")
+    parser.add_argument('--window', type=int, default=256, help="Pixels per side of the window read.")
+    args = parser.parse_args()
+
+    datasets = [filtered_dataset(args.size, seed) for seed in range(args.files)]
+    print(f"{'encoding':>14} {'MB':>8} {'write s':>8} {'read s':>8} {'window s':>8} {'max error m':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for label, options in encodings.items():
+            paths = []
+            start = time.perf_counter()
+            for i, ds in enumerate(datasets):
+                paths.append(write_wse(ds, os.path.join(folder, f"{label.replace(' ', '_')}_{i}.nc"), **options))
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            error = 0.0
+            for ds, path in zip(datasets, paths):
+                with open_wse(path) as out:
+                    values = out['wse'].values
+                error = max(error, float(np.nanmax(np.abs(values - ds['wse'].values))))
+            read_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for path in paths:
+                with open_wse(path) as out:
+                    out['wse'].isel(y=slice(0, args.window), x=slice(0, args.window)).values
+            window_time = time.perf_counter() - start
+
+            size = sum(path_size(path) for path in paths) / 1024 ** 2
+            print(f"{label:>14} {size:8.2f} {write_time:8.2f} {read_time:8.2f} {window_time:8.3f} {error:12.4f}")
+
+
+if __name__ == "__main__":
+    main()
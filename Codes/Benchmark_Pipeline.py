@@ -0,0 +1,151 @@
+"""
+End-to-end benchmark of the pipeline on synthetic SWOT granules (Synthetic_SWOT.py), offline.
+
+The stages run one after the other, each in its own Python process so its peak memory can be
+measured: download (copies from a local archive instead of earthaccess), filter (quantile filter,
+reprojection and clip), render (single-date images), mosaic and calendar. Every stage reports
+its wall time, peak RSS and the bytes it read and wrote.
+
+    python Benchmark_Pipeline.py --granules 12 --dates 4 --size 1400 --dpi 150
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import functools
+import argparse
+import resource
+import tempfile
+import subprocess
+from Instrumentation import io_bytes
+
+codes_dir = os.path.dirname(os.path.abspath(__file__))
+stages = ('download', 'filter', 'render', 'mosaic', 'calendar')
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process and of its finished children (render workers), in MB.
+    """
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, kB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale / 1024 ** 2
+
+
+def prepare(root, n_granules, n_dates, size, seed):
+    """
+    Lay out a workspace like the real one (Codes/, Filtered_Data/, ...) and write the archive.
+    """
+    from Synthetic_SWOT import write_archive
+    os.makedirs(os.path.join(root, 'Codes'), exist_ok=True)
+    shutil.copy(os.path.join(codes_dir, 'east-bengal.geojson'), os.path.join(root, 'Codes'))
+    for folder in ('Downloaded_Data', 'Filtered_Data'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    write_archive(os.path.join(root, 'Archive'), n_granules, n_dates, size=size, seed=seed)
+
+
+def run_stage(stage, root, args):
+    """
+    Run one stage in this process, from root/Codes like SWOT_Automated.sh does.
+    """
+    import Download_SWOT_Data
+    from Synthetic_SWOT import load_archive, archive_search, ArchiveDownload
+
+    os.chdir(os.path.join(root, 'Codes'))
+    Download_SWOT_Data.data_path = root
+    granules = load_archive(os.path.join(root, 'Archive'))
+    # The stand-in search returns the whole archive, whatever the period
+    results = Download_SWOT_Data.search_granules(None, None, search_data=archive_search(granules))
+    if stage in ('download', 'filter'):
+        import geopandas as gpd
+        results = Download_SWOT_Data.prefilter_granules(results, gpd.read_file('east-bengal.geojson'))
+
+    read_before, written_before = io_bytes()
+    start = time.perf_counter()
+    if stage == 'download':
+        for date_obj, granule in results:
+            local_path, native_id, output_path = Download_SWOT_Data.granule_paths(date_obj, granule)
+            Download_SWOT_Data.download_granule(granule, local_path, download=ArchiveDownload(os.path.join(root, 'Archive')))
+    elif stage == 'filter':
+        geojson_utm = gpd.read_file('east-bengal.geojson').to_crs(Download_SWOT_Data.utm45_crs)
+        process = Download_SWOT_Data.process_granule_windowed if args.mode == 'windowed' else \
+            Download_SWOT_Data.process_granule
+        if not args.no_reprojection_cache:
+            from Reprojection_Cache import ReprojectionCache
+            process = functools.partial(process, reprojection_cache=ReprojectionCache(
+                os.path.join(root, 'Reprojection_Cache')))
+        for date_obj, granule in results:
+            local_path, native_id, output_path = Download_SWOT_Data.granule_paths(date_obj, granule)
+            process(local_path, native_id, output_path, geojson_utm)
+            Download_SWOT_Data.remove_download(local_path)
+    elif stage == 'render':
+        import Create_SWOT_Image
+        Create_SWOT_Image.main(['--dpi', str(args.dpi), '--render-mode', args.render_mode, '--jobs', str(args.jobs)]
+                               + ([] if args.basemap else ['--no-basemap']))
+    elif stage == 'mosaic':
+        import Create_SWOT_Mosaicked_Image
+        Create_SWOT_Mosaicked_Image.process_all_files(render_mode=args.render_mode, dpi=args.dpi, jobs=args.jobs,
+                                                      basemap=args.basemap)
+    elif stage == 'calendar':
+        import Calendar_Dates
+        Calendar_Dates.main()
+    wall = time.perf_counter() - start
+    read_after, written_after = io_bytes()
+
+    return {'stage': stage, 'wall_s': wall, 'peak_rss_mb': peak_rss_mb(),
+            'read_mb': (read_after - read_before) / 1024 ** 2, 'written_mb': (written_after - written_before) / 1024 ** 2}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--granules', type=int, default=12, help="Synthetic granules in the archive.")
+    parser.add_argument('--dates', type=int, default=4, help="Dates the granules are spread over.")
+    parser.add_argument('--size', type=int, default=1400, help="Pixels per side of each granule.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic archive.")
+    parser.add_argument('--mode', choices=['full', 'windowed'], default='full', help="Filter mode.")
+    parser.add_argument('--render-mode', choices=['pcolormesh', 'raster'], default='raster', help="Render mode.")
+    parser.add_argument('--dpi', type=int, default=150, help="Resolution of the images.")
+    parser.add_argument('--jobs', type=int, default=1, help="Render worker processes.")
+    parser.add_argument('--no-reprojection-cache', action='store_true',
+                        help="Filter with rio.reproject instead of the cached gather indices (kept in --root).")
+    parser.add_argument('--basemap', action='store_true', help="Draw the OSM basemap (needs tiles or network).")
+    parser.add_argument('--stages', nargs='+', choices=stages, default=list(stages), help="Stages to run, in order.")
+    parser.add_argument('--root', default=None, help="Workspace to use and keep (default: a temporary folder).")
+    parser.add_argument('--json', default=None, help="Also save the results to this JSON file.")
+    parser.add_argument('--stage', choices=stages, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # Child process: run one stage and hand the measurements back on the last line
+        print(json.dumps(run_stage(args.stage, args.root, args)))
+        return
+
+    root = args.root or tempfile.mkdtemp(prefix='swot_benchmark_')
+    try:
+        prepare(root, args.granules, args.dates, args.size, args.seed)
+        child_args = list(sys.argv[1:])
+        if args.root is None:
+            child_args += ['--root', root]
+        results = []
+        print(f"{'stage':>10} {'wall s':>8} {'peak RSS MB':>12} {'read MB':>9} {'written MB':>11}")
+        for stage in args.stages:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', stage] + child_args,
+                                       capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{stage:>10} failed:\n{completed.stderr[-2000:]}")
+                break
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{stage:>10} {result['wall_s']:8.2f} {result['peak_rss_mb']:12.0f} "
+                  f"{result['read_mb']:9.1f} {result['written_mb']:11.1f}")
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'options': vars(args), 'results': results}, f, indent=2)
+    finally:
+        if args.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
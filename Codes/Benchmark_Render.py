@@ -0,0 +1,60 @@
+"""
+Benchmark the 'raster' render mode against the per-file pcolormesh mode on synthetic data
+and report the speedup and the pixel difference between the two images.
+
+    python Benchmark_Render.py --files 3 --size 1500 --dpi 300
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import Create_SWOT_Image
+from Synthetic_SWOT import write_filtered_files
+
+
+def pixel_diff(path_a, path_b, tolerance=0.05):
+    """
+    Return the fraction of pixels whose colour differs by more than `tolerance` and the mean difference.
+    """
+    a = plt.imread(path_a)[..., :3]
+    b = plt.imread(path_b)[..., :3]
+    height = min(a.shape[0], b.shape[0])
+    width = min(a.shape[1], b.shape[1])
+    diff = np.abs(a[:height, :width] - b[:height, :width]).max(axis=-1)
+    return float((diff > tolerance).mean()), float(diff.mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=3, help="Synthetic files drawn on the date.")
+    parser.add_argument('--size', type=int, default=1500, help="Pixels per side of each file.")
+    parser.add_argument('--dpi', type=int, default=300, help="Output resolution of both images.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        Create_SWOT_Image.netcdf_dir = folder
+        files = write_filtered_files(folder, args.files, args.size)
+        global_min, global_max = 0.0, 200.0
+
+        timings = {}
+        for mode in ('pcolormesh', 'raster'):
+            save_path = os.path.join(folder, f'{mode}.png')
+            start = time.perf_counter()
+            template = Create_SWOT_Image.make_template(basemap=False)
+            Create_SWOT_Image.plot_date(template, '20240101', files, global_min, global_max, render_mode=mode,
+                                        dpi=args.dpi, save_path=save_path)
+            timings[mode] = time.perf_counter() - start
+            template.close()
+            print(f"{mode:>10}: {timings[mode]:7.2f} s")
+
+        different, mean_diff = pixel_diff(os.path.join(folder, 'pcolormesh.png'), os.path.join(folder, 'raster.png'))
+        print(f"   speedup: {timings['pcolormesh'] / timings['raster']:.1f}x")
+        print(f"pixel diff: {100 * different:.3f}% of pixels differ, mean difference {mean_diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import re
+from Instrumentation import span, enable, summary
 
 # Define the source folders
 folders = {
@@ -7,36 +8,75 @@ folders = {
     'single_images': '../Figures/Single_Date_Image/'
 }
 
-# Create the available_dates folder and its subfolders if they don't exist
+# The available_dates folder gets one subfolder per source folder
 output_folder = '../Available_Dates/'
-os.makedirs(os.path.join(output_folder, 'mosaic_images'), exist_ok=True)
-os.makedirs(os.path.join(output_folder, 'single_images'), exist_ok=True)
 
 patterns = {
     'mosaic_images': re.compile(r'SWOT_Mosaicked_(\d{8})'),
     'single_images': re.compile(r'SWOT_(\d{8})')
 }
 
-# Loop over the folders and extract dates for each subfolder
-for subfolder_name, folder_path in folders.items():
+
+def image_dates(subfolder_name, filenames):
+    """
+    Dates of the image files of a subfolder.
+    """
     dates = set()
+    for filename in filenames:
+        match = patterns[subfolder_name].search(filename)  # Use the correct pattern for the folder
+        if match:
+            dates.add(match.group(1))
+    return dates
+
 
-    # Check if the folder exists
-    if os.path.exists(folder_path):
-        for filename in os.listdir(folder_path):
-            match = patterns[subfolder_name].search(filename)  # Use the correct pattern for the folder
-            if match:
-                dates.add(match.group(1))
+def dates_path(subfolder_name):
+    return os.path.join(output_folder, subfolder_name, 'available_dates.txt')
 
-    # Sort the dates to ensure consistency
-    sorted_dates = sorted(dates)
 
-    # Define the output file path
-    output_file = os.path.join(output_folder, subfolder_name, 'available_dates.txt')
+def read_dates(subfolder_name):
+    path = dates_path(subfolder_name)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return {line.strip() for line in file if line.strip()}
 
-    # Write the dates to available_dates.txt in the corresponding subfolder
-    with open(output_file, 'w') as file:
-        for date in sorted_dates:
+
+def write_dates(subfolder_name, dates):
+    """
+    Write the sorted dates to available_dates.txt of the subfolder, atomically.
+    """
+    output_file = dates_path(subfolder_name)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(f"{output_file}.tmp", 'w') as file:
+        for date in sorted(dates):
             file.write(f"{date}\n")
+    os.replace(f"{output_file}.tmp", output_file)
+
+
+def add_dates(subfolder_name, filenames):
+    """
+    Add the dates of new image files to available_dates.txt without listing the image folder.
+    """
+    new_dates = image_dates(subfolder_name, filenames) - read_dates(subfolder_name)
+    if new_dates:
+        write_dates(subfolder_name, read_dates(subfolder_name) | new_dates)
+    return new_dates
+
+
+def main():
+    # Loop over the folders and extract dates for each subfolder
+    for subfolder_name, folder_path in folders.items():
+        with span('calendar', folder=subfolder_name) as s:
+            # Check if the folder exists
+            filenames = os.listdir(folder_path) if os.path.exists(folder_path) else []
+            dates = image_dates(subfolder_name, filenames)
+            write_dates(subfolder_name, dates)
+            s.set(dates=len(dates))
+
 
-    # print(f"Available dates for {subfolder_name} have been saved to {output_file}.")
\ No newline at end of file
+if __name__ == "__main__":
+    # Spans are only recorded when SWOT_TRACE is set
+    print_summary = enable()
+    main()
+    if print_summary:
+        summary()
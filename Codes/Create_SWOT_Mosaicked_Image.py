@@ -1,179 +1,212 @@
-import xarray as xr
-import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 import os
 import numpy as np
 from matplotlib.colors import BoundaryNorm, ListedColormap
-import cartopy.io.img_tiles as cimgt
+from Map_Template import MapTemplate
 import warnings
+import argparse
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime, timedelta
+from WSE_Stats_Index import load_index, global_min_max
+from AOI_Grid import AOIGrid
+from Mosaic_Compositor import SlidingComposite
+from Fast_Render import warp_to_map, draw_raster, output_resolution
+from Parallel_Render import run_tasks, report_failures
+from Output_Format import is_wse_output, open_wse
+from Instrumentation import span, enable, summary
 
 warnings.filterwarnings("ignore")
 
 # Directory containing your NetCDF files
 netcdf_dir = '../Filtered_Data/'
 output_dir = '../Figures/Mosaicked_Image/'
+# Composite rasters are saved next to the figures' data
+composite_dir = '../Mosaicked_Data/'
+geojson_file = 'east-bengal.geojson'
+
+# Set up colormap and boundaries
+boundaries = [0, 5, 10, 15, 20, 40, 60, 100, 500, 1000, 1600]
+colors = ['#4575b4', '#74add1', '#abd9e9', '#e0f3f8', '#ffffbf', '#fee090', '#fdae61', '#f46d43', '#d73027', '#fc0516', '#a50026']
+cmap = ListedColormap(colors)
+norm = BoundaryNorm(boundaries, len(colors))
+
+# Map template of this process, built on first use (each render worker gets its own)
+_template = None
 
 # Ensure output directory exists
 if not os.path.exists(output_dir):
     os.makedirs(output_dir)
+os.makedirs(composite_dir, exist_ok=True)
 
-def get_files_within_days(target_date, days=10):
+def group_files_by_date():
     """
-    Get files within the last 'days' from the target_date (including target_date).
+    List the filtered files once and group them by date, oldest first.
     """
-    files = [file for file in os.listdir(netcdf_dir) if file.endswith('.nc')]
-    files_within_days = []
-    for file in files:
-        file_date_str = file.split('_')[2]  # Extract date part from filename
-        file_date = datetime.strptime(file_date_str, '%Y%m%d')  # Convert to datetime object
+    files_by_date = defaultdict(list)
+    for file in sorted(os.listdir(netcdf_dir)):
+        if is_wse_output(file):
+            file_date = datetime.strptime(file.split('_')[2], '%Y%m%d')  # Extract date part from filename
+            files_by_date[file_date].append(file)
+    return dict(sorted(files_by_date.items()))
 
-        # Include files with dates within 'days' before or on the target date
-        if (target_date - timedelta(days=days)) <= file_date <= target_date:
-            files_within_days.append((file, file_date))
-    
-    return files_within_days
 
-
-def estimate_global_min_max(files_within_days):
-    """
-    Estimate global min and max values from the files.
+def estimate_global_min_max(files_within_days, stats_index):
     """
-    global_min = np.inf
-    global_max = -np.inf
-    
-    for file, file_date in files_within_days:
-        filepath = os.path.join(netcdf_dir, file)
-        try:
-            ds = xr.open_dataset(filepath)
-            data_positive = ds['wse'].where(ds['wse'] >= 0, np.nan)  # Only positive values
-            global_min = min(global_min, np.nanmin(data_positive))
-            global_max = max(global_max, np.nanmax(data_positive))
-            ds.close()
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-            continue
-
-    return global_min, global_max
-
-
-def plot_wse(files_within_days, global_min, global_max, oldest_date, latest_date):
+    Estimate global min and max values from the stats index of the files.
     """
-    Plot the WSE for the selected files within the date range.
-    """
-    # Set up colormap and boundaries based on global min/max
-    boundaries = [0, 5, 10, 15, 20, 40, 60, 100, 500, 1000, 1600]
-    colors = ['#4575b4', '#74add1', '#abd9e9', '#e0f3f8', '#ffffbf', '#fee090', '#fdae61', '#f46d43', '#d73027', '#fc0516', '#a50026']
-    cmap = ListedColormap(colors)
-    norm = BoundaryNorm(boundaries, len(colors))
-
-    # Set up the map projection and axes
-    fig = plt.figure(figsize=(12, 8))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-
-    # Add basemap (OpenStreetMap)
-    osm = cimgt.OSM()
-    ax.add_image(osm, 10)
-
-    # Add coastlines and borders
-    ax.coastlines()
-    ax.add_feature(cfeature.BORDERS, linestyle=':')
-
-    # Set extent (latitude and longitude bounds)
-    ax.set_extent([89.6896, 96.1684, 17.0045, 25.7795], crs=ccrs.PlateCarree())
-
-    # Loop through each NetCDF file and plot the data
-    for file, file_date in files_within_days:
-        filepath = os.path.join(netcdf_dir, file)
-        try:
-            ds = xr.open_dataset(filepath)
-            data_clipped = ds['wse'].where(ds['wse'] <= global_max, np.nan).assign_coords(x=ds['x'], y=ds['y'])
-            data_clipped.plot.pcolormesh(ax=ax, transform=ccrs.UTM(zone=45), cmap=cmap, norm=norm, add_colorbar=False)
-            ds.close()
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-            continue
-
-    # Add a colorbar (once at the end)
-    sm = plt.cm.ScalarMappable(cmap=cmap, norm=norm)
-    sm.set_array([])  # Empty array for colorbar mapping
-    cbar = plt.colorbar(sm, ax=ax, orientation='vertical', pad=0.02, label='Water Surface Elevation (wse)')
-    cbar.set_ticks(boundaries)
-    tick_labels = [f'{b:.0f}m' for b in boundaries[:-1]]
-    tick_labels.append(f'>{boundaries[-1]:.0f}m')
-    cbar.set_ticklabels(tick_labels)
-
-    # Adding North Arrow
-    ax.annotate('N', xy=(0.9, 0.95), xytext=(0.9, 0.9),
-                arrowprops=dict(facecolor='black', width=5, headwidth=15),
-                ha='center', va='center', fontsize=12,
-                xycoords=ax.transAxes)
-
-    # Adding Scale Bar
-    add_scalebar(ax, length_in_km=100, location=(0.1, 0.05))
-
-    # Adding Gridlines
-    gridlines = ax.gridlines(draw_labels=True, linestyle=':', color='gray', alpha=0.7)
-    gridlines.top_labels = False
-    gridlines.right_labels = False
-
-    # Set plot title
-    plt.title(f'SWOT WSE from {oldest_date.strftime("%d %b %Y")} to {latest_date.strftime("%d %b %Y")}')
-
-    # Save plot
-    output_filepath = os.path.join(output_dir, f'SWOT_Mosaicked_{latest_date.strftime("%Y%m%d")}.jpeg')
-    plt.savefig(output_filepath, dpi=1200, bbox_inches='tight')
-    plt.close(fig)  # Close the figure to avoid memory issues
+    files = [file for file, file_date in files_within_days]
+    return global_min_max(netcdf_dir, files, stats_index)
 
 
-def add_scalebar(ax, length_in_km, location=(0.1, 0.05), linewidth=3):
+def make_template(basemap=True, offline=False):
     """
-    Add a scale bar to the map.
+    Build the static map layers once for all target dates.
     """
-    x0, x1 = ax.get_xlim()
-    y0, y1 = ax.get_ylim()
-    scale_length_deg = length_in_km / 111  # 111 km per degree
-    x_start = x0 + (x1 - x0) * location[0]
-    y_start = y0 + (y1 - y0) * location[1]
-    ax.plot([x_start, x_start + scale_length_deg], [y_start, y_start], color='black', linewidth=linewidth, transform=ccrs.PlateCarree())
-    ax.text((x_start + x_start + scale_length_deg) / 2, y_start + 0.02, f'{length_in_km} km',
-            ha='center', va='bottom', fontsize=10, transform=ccrs.PlateCarree())
+    return MapTemplate(cmap, norm, boundaries, extent=[89.6896, 96.1684, 17.0045, 25.7795], basemap=basemap,
+                       offline=offline)
+
 
+def get_template(basemap=True, offline=False):
+    global _template
+    if _template is None:
+        _template = make_template(basemap, offline)
+    return _template
 
-def process_all_files():
+
+def plot_wse(template, composite, global_min, global_max, oldest_date, latest_date, render_mode='pcolormesh',
+             dpi=1200, output_filepath=None):
     """
-    Main function to loop over all NetCDF files and process them.
-    Skips files if the corresponding image already exists.
+    Plot the WSE composite for the selected date range on the map template.
+    The composite is a list of blocks (SlidingComposite.composite) that already hold every granule
+    of the window, so each covered block is drawn once and empty parts of the AOI are not drawn.
+    render_mode 'raster' warps the blocks once to the map projection, no finer than one output pixel,
+    and draws them with imshow.
     """
-    files = [file for file in os.listdir(netcdf_dir) if file.endswith('.nc')]
-    files.sort()
+    blocks = [block.where(block <= global_max, np.nan) for block in composite]
 
-    # Loop over each file and process
-    for file in files:
-        # Extract the date from the filename (assuming it's in YYYYMMDD format)
-        date_str = file.split('_')[2]
-        target_date = datetime.strptime(date_str, '%Y%m%d')
+    def draw(ax):
+        if not blocks:
+            return []
+        if render_mode == 'raster':
+            warped = warp_to_map(blocks, min_resolution=output_resolution(ax, dpi))
+            return [draw_raster(ax, warped, cmap=cmap, norm=norm)]
+        return [block.plot.pcolormesh(ax=ax, transform=ccrs.UTM(zone=45), cmap=cmap, norm=norm, add_colorbar=False)
+                for block in blocks]
 
-        # Check if the image for this date already exists
-        output_filepath = os.path.join(output_dir, f'SWOT_Mosaicked_{target_date.strftime("%Y%m%d")}.jpeg')
-        if os.path.exists(output_filepath):
-            # print(f"Image for {target_date.strftime('%Y%m%d')} already exists. Skipping...")
-            continue  # Skip to the next file if the image exists
+    # Save plot
+    if output_filepath is None:
+        output_filepath = os.path.join(output_dir, f'SWOT_Mosaicked_{latest_date.strftime("%Y%m%d")}.jpeg')
+    title = f'SWOT WSE from {oldest_date.strftime("%d %b %Y")} to {latest_date.strftime("%d %b %Y")}'
+    return template.render(draw, title, output_filepath, dpi=dpi)
 
-        # Find files within the last 10 days (only past files)
-        files_within_days = get_files_within_days(target_date)
 
-        # Estimate global min and max values
-        global_min, global_max = estimate_global_min_max(files_within_days)
+def render_mosaic(composite, global_min, global_max, oldest_date, latest_date, render_mode='pcolormesh', dpi=1200,
+                  basemap=True, offline=False):
+    """
+    Render one composite on this process's map template.
+    """
+    with span('render_mosaic', date=latest_date.strftime("%Y%m%d")):
+        return plot_wse(get_template(basemap, offline), composite, global_min, global_max, oldest_date, latest_date,
+                        render_mode=render_mode, dpi=dpi)
 
-        # Get the oldest and latest date in the group
-        dates_in_group = [file_date for _, file_date in files_within_days]
-        oldest_date_in_group = min(dates_in_group)
-        latest_date_in_group = max(dates_in_group)
 
-        # Plot WSE
-        plot_wse(files_within_days, global_min, global_max, oldest_date_in_group, latest_date_in_group)
+def process_all_files(days=10, method='latest', render_mode='pcolormesh', dpi=1200, jobs=1, basemap=True,
+                      offline=False):
+    """
+    Main function to build the sliding N-day composites and plot them.
+    Every granule is resampled once onto the fixed AOI grid and the composite is updated as the
+    window moves forward. Skips dates if the corresponding image already exists.
+    The composites are built in this process; with jobs > 1 they are rendered by worker processes.
+    Returns the dates that failed, with their errors.
+    """
+    global _template
+    files_by_date = group_files_by_date()
+    dates = list(files_by_date)
+    stats_index = load_index(netcdf_dir)
+
+    # Dates whose mosaic does not exist yet
+    pending = [file_date for file_date in dates
+               if not os.path.exists(os.path.join(output_dir, f'SWOT_Mosaicked_{file_date.strftime("%Y%m%d")}.jpeg'))]
+    if not pending:
+        return {}
+
+    # A date only has to be read if one of the pending windows includes it
+    def is_needed(file_date):
+        i = bisect_left(pending, file_date)
+        return i < len(pending) and pending[i] <= file_date + timedelta(days=days)
+
+    grid = AOIGrid.from_geojson(geojson_file)
+    compositor = SlidingComposite(grid, days=days, method=method)
+
+    def tasks():
+        for target_date in dates:
+            # Slide the window: drop the expired days, then add the new one
+            compositor.expire(target_date)
+            if is_needed(target_date):
+                for file in files_by_date[target_date]:
+                    try:
+                        with span('resample', file=file) as s, open_wse(os.path.join(netcdf_dir, file)) as ds:
+                            flat_index, values = grid.resample(ds['wse'])
+                            compositor.add(target_date, flat_index, values)
+                            s.set(pixels=values.size)
+                    except Exception as e:
+                        print(f"Error processing {file}: {e}")
+                        continue
+
+            if target_date not in pending:
+                continue
+
+            # Files within the last 10 days (only past files)
+            files_within_days = [(file, file_date) for file_date in sorted(set(compositor.dates))
+                                 for file in files_by_date[file_date]]
+            if not files_within_days:
+                continue
+
+            # Estimate global min and max values
+            global_min, global_max = estimate_global_min_max(files_within_days, stats_index)
+
+            # Get the oldest and latest date in the group
+            dates_in_group = [file_date for _, file_date in files_within_days]
+            oldest_date_in_group = min(dates_in_group)
+            latest_date_in_group = max(dates_in_group)
+
+            # Save the composite as a raster product, then plot it
+            composite_path = os.path.join(composite_dir, f'SWOT_Mosaicked_{target_date.strftime("%Y%m%d")}.tif')
+            with span('composite', date=target_date.strftime("%Y%m%d"), files=len(files_within_days)) as s:
+                composite = compositor.composite()
+                if composite:
+                    grid.write_raster(composite_path, composite)
+                    s.set(blocks=len(composite), bytes=os.path.getsize(composite_path))
+            yield target_date.strftime("%Y%m%d"), (composite, global_min, global_max, oldest_date_in_group,
+                                                  latest_date_in_group, render_mode, dpi, basemap, offline)
+
+    # The static map layers are drawn once per process and reused for every target date
+    failures = run_tasks(render_mosaic, tasks(), jobs=jobs)
+    if _template is not None:
+        _template.close()
+        _template = None
+    report_failures(failures)
+    return failures
+
 
 if __name__ == "__main__":
-    process_all_files()
+    parser = argparse.ArgumentParser(description="Create sliding-window SWOT WSE mosaics.")
+    parser.add_argument('--days', type=int, default=10, help="Window length in days before each date.")
+    parser.add_argument('--method', choices=['latest', 'mean', 'median'], default='latest',
+                        help="How overlapping granules are combined.")
+    parser.add_argument('--render-mode', choices=['pcolormesh', 'raster'], default='pcolormesh',
+                        help="'raster' warps the composite once and draws it as one image.")
+    parser.add_argument('--dpi', type=int, default=1200, help="Output resolution of the JPEG images.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes rendering dates in parallel.")
+    parser.add_argument('--no-basemap', action='store_true', help="Leave out the OSM basemap, coastlines and borders.")
+    parser.add_argument('--offline', action='store_true',
+                        help="Never download basemap tiles; tiles missing from the cache are drawn blank.")
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help="Append timing, memory and I/O spans to FILE as JSON lines (same as SWOT_TRACE=FILE).")
+    args = parser.parse_args()
+    print_summary = enable(args.trace)
+    process_all_files(days=args.days, method=args.method, render_mode=args.render_mode, dpi=args.dpi, jobs=args.jobs,
+                      basemap=not args.no_basemap, offline=args.offline)
+    if print_summary:
+        summary()
@@ -1,51 +1,76 @@
 import os
 import shutil
+import time
+import argparse
+import threading
+import functools
 import xarray as xr
 import earthaccess
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
 import geopandas as gpd
 import numpy as np
 import warnings
 import logging
+from Quantile_Filter import quantile_cut_points, apply_quantile_filter, quantile_drop_indexers, drop_empty
+from Granule_Catalog import GranuleCatalog, file_checksum
+from WSE_Stats_Index import compute_stats, write_stats
+from Output_Format import write_wse, path_size
+from AOI_Grid import AOIGrid
+from Instrumentation import span, enable, summary
+from Remote_Access import open_remote, fetched_bytes, RangeReadsUnsupported
+from Regions import RegionRegistry, footprint_overlaps, granule_size
+from Reprojection_Cache import ReprojectionCache
+from shapely.geometry import box
+from rioxarray.exceptions import NoDataInBounds
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
 data_path = r"/water3/skhan7/SWOT_BD_Tripura/"
 
-# Create a log folder if it doesn't exist
-log_folder = rf"{data_path}/Logs/"
-if not os.path.exists(log_folder):
-    os.makedirs(log_folder)
-    os.makedirs(f"{data_path}/Downloaded_Data/", exist_ok=True)
-    os.makedirs(f"{data_path}/Filtered_Data/", exist_ok=True)
-
-
-# Generate a log file name with the current date and time in YMDHHMMSS format
-log_file_name = datetime.now().strftime("log_%Y%m%d%H%M%S.log")
-
-# Configure logging to use the dynamically generated log file name
-logging.basicConfig(
-    filename=os.path.join(log_folder, log_file_name),
-    filemode='a',
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-
-logging.info("Starting the data download and processing script.")
-
-try:
-    auth = earthaccess.login(strategy='netrc')
-    end_date = datetime.today().strftime('%Y-%m-%d')
-    start_date = (datetime.today() - timedelta(days=18)).strftime('%Y-%m-%d')
-    logging.info(f"Start date {start_date} and end date {end_date} for granules search.")
-    results = earthaccess.search_data(
-        short_name="SWOT_L2_HR_Raster_2.0",
-        bounding_box=(89.7, 17.0, 94.9, 25.75),
-        granule_name='*100m*PIC*_01',
-        temporal=(str(start_date), str(end_date)),
+utm45_crs = "EPSG:32645"
+utm46_crs = "EPSG:32646"
+utm44_crs = "EPSG:32644"
+
+
+def setup_logging():
+    """
+    Create the data folders and point logging at a new timestamped log file.
+    """
+    # Create a log folder if it doesn't exist
+    log_folder = rf"{data_path}/Logs/"
+    if not os.path.exists(log_folder):
+        os.makedirs(log_folder)
+        os.makedirs(f"{data_path}/Downloaded_Data/", exist_ok=True)
+        os.makedirs(f"{data_path}/Filtered_Data/", exist_ok=True)
+
+    # Generate a log file name with the current date and time in YMDHHMMSS format
+    log_file_name = datetime.now().strftime("log_%Y%m%d%H%M%S.log")
+
+    # Configure logging to use the dynamically generated log file name
+    logging.basicConfig(
+        filename=os.path.join(log_folder, log_file_name),
+        filemode='a',
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        level=logging.INFO
     )
 
+
+def search_granules(start_date, end_date, search_data=earthaccess.search_data, bounding_box=(89.7, 17.0, 94.9, 25.75)):
+    """
+    Search for SWOT raster granules and keep the ones with a 100 m raster link.
+    `search_data` can be swapped for a local stand-in of earthaccess.search_data.
+    """
+    with span('search') as s:
+        results = search_data(
+            short_name="SWOT_L2_HR_Raster_2.0",
+            bounding_box=bounding_box,
+            granule_name='*100m*PIC*_01',
+            temporal=(str(start_date), str(end_date)),
+        )
+        s.set(granules=len(results))
+
     logging.info(f"Found {len(results)} granules for the given search criteria.")
 
     filtered_results = []
@@ -56,86 +81,814 @@ try:
                 # Extract the date from the granule metadata
                 date_str = granule.get("umm")['TemporalExtent']['RangeDateTime']['EndingDateTime']
                 date_obj = datetime.fromisoformat(date_str.rstrip('Z'))  # Remove 'Z' and parse
-                
+
                 # Log the date of each granule found
                 logging.info(f"Found granule with date: {date_obj.strftime('%Y-%m-%d')}")
 
                 filtered_results.append((date_obj, granule))
                 break
 
-    geojson_file = rf"{data_path}/Codes/east-bengal.geojson"
-    geojson = gpd.read_file(geojson_file)
-    utm45_crs = "EPSG:32645"
-    utm46_crs = "EPSG:32646"
-    utm44_crs = "EPSG:32644"
-    geojson_utm = geojson.to_crs(utm45_crs)
+    return filtered_results
 
-    for date_obj, granule in filtered_results:
-        download_url = granule.data_links()[0]
-        local_path = rf"{data_path}/Downloaded_Data/SWOT_BD_{date_obj.strftime('%Y%m%d')}_{granule['umm']['RelatedUrls'][0]['URL'].split('x_x_x')[1].split('F')[0]}"
-        
-        # Download the file
-        logging.info(f"Downloading file from {download_url} to {local_path}.")
-        earthaccess.download(download_url, local_path=local_path)
-        native_id = granule.get('meta')['native-id']
-
-        # Load the NetCDF file using xarray
+
+def prefilter_granules(filtered_results, aoi, min_overlap=0.0):
+    """
+    Drop the granules whose UMM footprint does not overlap the AOI, or overlaps less than the
+    fraction min_overlap of the footprint, before they are downloaded.
+    Granules without a footprint are kept.
+    """
+    with span('prefilter', granules=len(filtered_results)) as s:
+        overlaps = footprint_overlaps([granule for date_obj, granule in filtered_results], aoi)
+        kept = []
+        saved = 0
+        for (date_obj, granule), overlap in zip(filtered_results, overlaps):
+            if overlap is None or (overlap > 0 and overlap >= min_overlap):
+                kept.append((date_obj, granule))
+                continue
+            size = granule_size(granule)
+            saved += size
+            logging.info(f"Skipping {granule['meta']['native-id']}: {overlap:.1%} of its footprint overlaps "
+                         f"the AOI ({size / 1024 ** 2:.1f} MB not downloaded).")
+        s.set(skipped=len(filtered_results) - len(kept), bytes=saved)
+    logging.info(f"The footprint prefilter kept {len(kept)} of {len(filtered_results)} granules and saved "
+                 f"{saved / 1024 ** 2:.1f} MB of downloads.")
+    return kept
+
+
+def granule_paths(date_obj, granule):
+    """
+    Return the download folder, native id and filtered output path of a granule.
+    """
+    native_id = granule.get('meta')['native-id']
+    local_path = rf"{data_path}/Downloaded_Data/SWOT_BD_{date_obj.strftime('%Y%m%d')}_{granule['umm']['RelatedUrls'][0]['URL'].split('x_x_x')[1].split('F')[0]}"
+    output_path = f"{data_path}/Filtered_Data/SWOT_BD_{date_obj.strftime('%Y%m%d')}_{native_id.split('x_x_x_')[1].split('F')[0]}_wse.nc"
+    return local_path, native_id, output_path
+
+
+def download_granule(granule, local_path, download=earthaccess.download, retries=3, retry_wait=30):
+    """
+    Download a granule into local_path, retrying on failure with a growing wait.
+    `download` can be swapped for a local stand-in of earthaccess.download.
+    """
+    download_url = granule.data_links()[0]
+    for attempt in range(1, retries + 1):
+        try:
+            logging.info(f"Downloading file from {download_url} to {local_path} (attempt {attempt}/{retries}).")
+            with span('download', granule=granule['meta']['native-id'], attempt=attempt) as s:
+                download(download_url, local_path=local_path)
+                s.set(bytes=path_size(local_path))
+            return
+        except Exception as e:
+            logging.warning(f"Download of {download_url} failed on attempt {attempt}/{retries}: {e}")
+            if attempt == retries:
+                raise
+            time.sleep(retry_wait * attempt)
+
+
+def granule_crs(native_id):
+    """
+    Return the UTM CRS of a granule from the zone in its native id, or None if there is none.
+    """
+    if "UTM46" in native_id:
+        return utm46_crs
+    elif "UTM45" in native_id:
+        return utm45_crs
+    elif "UTM44" in native_id:
+        return utm44_crs
+    return None
+
+
+def process_granule(local_path, native_id, output_path, geojson_utm, quantile_method='exact', quantile_scope='tile',
+                    output_options=None, reprojection_cache=None):
+    """
+    Quantile-filter, reproject to UTM45 and clip one downloaded granule, then write the wse output.
+    output_options go to Output_Format.write_wse (store, compression, dtype, chunks).
+    reprojection_cache is a Reprojection_Cache.ReprojectionCache to warp with, or None for rio.reproject.
+    Returns the path written, or None if the granule has no UTM zone or no data inside the AOI.
+    Any other error is raised, so the granule is recorded as failed and retried on the next run.
+    """
+    src_crs = granule_crs(native_id)
+    if src_crs is None:
+        logging.warning(f"File {native_id} does not contain UTM information. Skipping.")
+        return None
+
+    # Load the NetCDF file using xarray
+    with span('read', granule=native_id) as s:
         ds = xr.open_dataset(f'{local_path}/{native_id}.nc')
-        ds = ds.astype('float32') 
-        quantile_low = np.float32(ds['wse'].quantile(0.05).item())
-        quantile_high = np.float32(ds['wse'].quantile(0.95).item())
+        ds = ds.astype('float32')
+        s.set(pixels=ds.sizes['y'] * ds.sizes['x'])
+    with span('quantile', granule=native_id):
+        quantile_low, quantile_high = granule_quantiles(ds, geojson_utm, src_crs, quantile_method, quantile_scope)
         logging.info(f"Quantiles for wse: low={quantile_low}, high={quantile_high}")
+        if np.isnan(quantile_low):
+            logging.warning(f"File {native_id} has no wse values in the {quantile_scope} quantile scope. Skipping.")
+            ds.close()
+            return None
+        # With the reprojection cache, empty rows and columns are only dropped after the warp, so the
+        # grid that is warped (and keys the cache) is the tile's own grid rather than one that depends
+        # on the data. Without it they are dropped first, as before.
+        cached_warp = reprojection_cache is not None and src_crs != utm45_crs
+        ds = apply_quantile_filter(ds, quantile_low, quantile_high, drop=not cached_warp)
 
-        condition_1 = ds['wse'] >= quantile_low
-        condition_2 = ds['wse'] <= quantile_high
-        ds = ds.where(condition_1, drop=True).where(condition_2, drop=True)
-
-        if "UTM46" in granule.get('meta')['native-id']:
-            logging.info(f"Reprojecting {native_id} from UTM Zone 46 to UTM Zone 45.")
-            ds.rio.write_crs(utm46_crs, inplace=True)
-            ds_utm = ds.rio.reproject(utm45_crs)
-        elif "UTM45" in native_id:
-            logging.info(f"File {native_id} is already in UTM Zone 45. Writing CRS as UTM45.")
-            ds.rio.write_crs(utm45_crs, inplace=True)
-            ds_utm = ds
-        elif "UTM44" in granule.get('meta')['native-id']:
-            logging.info(f"Reprojecting {native_id} from UTM Zone 44 to UTM Zone 45.")
-            ds.rio.write_crs(utm44_crs, inplace=True)
-            ds_utm = ds.rio.reproject(utm45_crs)
-        else:
-            logging.warning(f"File {native_id} does not contain UTM information. Skipping.")
-            pass
+    ds.rio.write_crs(src_crs, inplace=True)
+    if src_crs == utm45_crs:
+        logging.info(f"File {native_id} is already in UTM Zone 45. Writing CRS as UTM45.")
+        ds_utm = ds
+    else:
+        logging.info(f"Reprojecting {native_id} from {src_crs} to UTM Zone 45.")
+        with span('reproject', granule=native_id, src_crs=src_crs) as s:
+            ds_utm = reproject(ds, utm45_crs, reprojection_cache)
+            s.set(pixels=ds_utm.sizes['y'] * ds_utm.sizes['x'])
+        if cached_warp:
+            ds_utm = drop_empty(ds_utm)
 
-        try:
+    try:
+        with span('clip', granule=native_id) as s:
             ds_filtered = ds_utm.rio.clip(geojson_utm.geometry, geojson_utm.crs)
             wse_filtered = ds_filtered[['wse']]
+            s.set(pixels=wse_filtered.sizes['y'] * wse_filtered.sizes['x'])
+    except NoDataInBounds as e:
+        logging.warning(f"File {native_id} has no data inside the AOI. Skipping: {e}")
+        ds.close()
+        return None
+
+    output_path = write_output(wse_filtered, output_path, native_id, output_options)
+
+    # Close the dataset
+    ds.close()
+    return output_path
+
+
+def reproject(ds, crs, cache=None):
+    """
+    ds.rio.reproject(crs), or the same warp from the gather index of the reprojection cache if one is given.
+    """
+    return cache.reproject(ds, crs) if cache is not None else ds.rio.reproject(crs)
+
+
+def aoi_window(ds, geojson, crs):
+    """
+    Return the x/y slices of ds that cover the AOI in the granule's own CRS, padded by one pixel.
+    """
+    minx, miny, maxx, maxy = geojson.to_crs(crs).total_bounds
+    x = ds['x'].values
+    y = ds['y'].values
+    pad_x = abs(x[1] - x[0]) if len(x) > 1 else 0
+    pad_y = abs(y[1] - y[0]) if len(y) > 1 else 0
+    minx, maxx, miny, maxy = minx - pad_x, maxx + pad_x, miny - pad_y, maxy + pad_y
+
+    # Coordinate slices have to follow the order of the axis
+    x_slice = slice(minx, maxx) if x[0] <= x[-1] else slice(maxx, minx)
+    y_slice = slice(miny, maxy) if y[0] <= y[-1] else slice(maxy, miny)
+    return x_slice, y_slice
+
+
+def granule_quantiles(ds, geojson_utm, src_crs, method='exact', scope='tile'):
+    """
+    Return the 5% and 95% wse quantiles of a granule, NaN if there is no wse value in the scope.
+    scope is 'tile' for every pixel, 'window' for the AOI bounding window or 'aoi' for the pixels
+    inside the AOI polygon; method is 'exact' or 'histogram' (see Quantile_Filter.py).
+    """
+    wse = ds['wse']
+    if scope == 'window':
+        x_slice, y_slice = aoi_window(ds, geojson_utm, src_crs)
+        wse = wse.sel(x=x_slice, y=y_slice)
+    elif scope == 'aoi':
+        geojson = geojson_utm.to_crs(src_crs)
+        try:
+            wse = wse.rio.write_crs(src_crs).rio.clip(geojson.geometry, geojson.crs)
+        except NoDataInBounds:
+            return np.float32(np.nan), np.float32(np.nan)
+    elif scope != 'tile':
+        raise ValueError(f"Unknown quantile scope: {scope}")
+    return quantile_cut_points(wse, 0.05, 0.95, method=method)
+
+
+def process_granule_windowed(local_path, native_id, output_path, geojson_utm, variables=('wse',),
+                             quantile_method='exact', quantile_scope='window', output_options=None, source=None,
+                             reprojection_cache=None):
+    """
+    Clip-first variant of process_granule. Only the requested variables are read, and only over
+    the AOI window worked out in the granule's own CRS; the quantile filter, reprojection and clip
+    then run on that subset, so the cost per granule follows the AOI overlap instead of the tile size.
+    By default the 5-95% quantiles are taken over the window rather than the whole tile;
+    quantile_scope='tile' reads the full wse variable for them instead.
+    source is an open remote file (Remote_Access.open_remote) to read instead of the download.
+    """
+    src_crs = granule_crs(native_id)
+    if src_crs is None:
+        logging.warning(f"File {native_id} does not contain UTM information. Skipping.")
+        return None
+
+    variables = ['wse'] + [v for v in variables if v != 'wse']
+
+    # Opening is lazy, so only the selected variables over the window are read from disk
+    with span('read', granule=native_id) as s, \
+            xr.open_dataset(source if source is not None else f'{local_path}/{native_id}.nc') as ds:
+        x_slice, y_slice = aoi_window(ds, geojson_utm, src_crs)
+        window = ds[variables].sel(x=x_slice, y=y_slice)
+        if window.sizes['x'] == 0 or window.sizes['y'] == 0:
+            logging.warning(f"File {native_id} does not overlap the AOI. Skipping.")
+            return None
+        if quantile_scope == 'tile':
+            with span('quantile', granule=native_id, scope='tile'):
+                quantile_low, quantile_high = granule_quantiles(ds, geojson_utm, src_crs, quantile_method, 'tile')
+        window = window.astype('float32').load()
+        s.set(pixels=window.sizes['y'] * window.sizes['x'])
+
+    logging.info(f"Read a {window.sizes['y']} x {window.sizes['x']} window of {native_id}.")
+
+    with span('quantile', granule=native_id):
+        if quantile_scope != 'tile':
+            # The window already covers the AOI, so both scopes can be worked out from it
+            quantile_low, quantile_high = granule_quantiles(window, geojson_utm, src_crs, quantile_method,
+                                                            quantile_scope)
+        logging.info(f"Quantiles for wse: low={quantile_low}, high={quantile_high}")
+        if np.isnan(quantile_low):
+            logging.warning(f"File {native_id} has no wse values in the {quantile_scope} quantile scope. Skipping.")
+            return None
+        # With the reprojection cache the fixed AOI window is warped and trimmed afterwards
+        cached_warp = reprojection_cache is not None and src_crs != utm45_crs
+        window = apply_quantile_filter(window, quantile_low, quantile_high, drop=not cached_warp)
+
+    window.rio.write_crs(src_crs, inplace=True)
+    if src_crs == utm45_crs:
+        window_utm = window
+    else:
+        logging.info(f"Reprojecting the window of {native_id} from {src_crs} to UTM Zone 45.")
+        with span('reproject', granule=native_id, src_crs=src_crs) as s:
+            window_utm = reproject(window, utm45_crs, reprojection_cache)
+            s.set(pixels=window_utm.sizes['y'] * window_utm.sizes['x'])
+        if cached_warp:
+            window_utm = drop_empty(window_utm)
+
+    try:
+        with span('clip', granule=native_id) as s:
+            wse_filtered = window_utm.rio.clip(geojson_utm.geometry, geojson_utm.crs)[variables]
+            s.set(pixels=wse_filtered.sizes['y'] * wse_filtered.sizes['x'])
+    except NoDataInBounds as e:
+        logging.warning(f"File {native_id} has no data inside the AOI. Skipping: {e}")
+        return None
+
+    return write_output(wse_filtered, output_path, native_id, output_options)
+
+
+def data_footprint(ds, crs):
+    """
+    Lon/lat outline of the pixel centres of a raster.
+    """
+    x = ds['x'].values
+    y = ds['y'].values
+    outline = box(x.min(), y.min(), x.max(), y.max())
+    return gpd.GeoSeries([outline], crs=crs).to_crs("EPSG:4326").iloc[0]
+
+
+def process_granule_regions(local_path, native_id, output_path, registry, windowed=True, variables=('wse',),
+                            quantile_method='exact', quantile_scope=None, output_options=None, source=None,
+                            reprojection_cache=None):
+    """
+    Multi-region variant of process_granule and process_granule_windowed. The granule is read and
+    quantile-filtered once, reprojected once per output CRS, then clipped and written for every
+    region of the registry (Regions.py) it touches, to the region's output folder under the file
+    name of output_path. The registry takes the place of the AOI GeoDataFrame.
+    windowed=True reads only the window covering all those regions. The quantiles are taken over
+    the tile, that window or the union of the region polygons (quantile_scope 'tile', 'window' or
+    'aoi'; default 'window' when windowed, else 'tile').
+    Returns the paths written, one per region with data.
+    """
+    src_crs = granule_crs(native_id)
+    if src_crs is None:
+        logging.warning(f"File {native_id} does not contain UTM information. Skipping.")
+        return []
+
+    variables = ['wse'] + [v for v in variables if v != 'wse']
+    quantile_scope = quantile_scope or ('window' if windowed else 'tile')
+    tile_quantiles = windowed and quantile_scope == 'tile'
+
+    with span('read', granule=native_id) as s, \
+            xr.open_dataset(source if source is not None else f'{local_path}/{native_id}.nc') as ds:
+        regions = registry.regions_for(data_footprint(ds, src_crs))
+        if not regions:
+            logging.warning(f"File {native_id} does not overlap any region. Skipping.")
+            return []
+        aoi = registry.aoi(regions)
+        data = ds
+        if windowed:
+            x_slice, y_slice = aoi_window(ds, aoi, src_crs)
+            data = ds[variables].sel(x=x_slice, y=y_slice)
+            if data.sizes['x'] == 0 or data.sizes['y'] == 0:
+                logging.warning(f"File {native_id} does not overlap any region. Skipping.")
+                return []
+        if tile_quantiles:
+            with span('quantile', granule=native_id, scope='tile'):
+                quantile_low, quantile_high = granule_quantiles(ds, aoi, src_crs, quantile_method, 'tile')
+        data = data.astype('float32').load()
+        s.set(pixels=data.sizes['y'] * data.sizes['x'], regions=len(regions))
+
+    logging.info(f"Read {data.sizes['y']} x {data.sizes['x']} pixels of {native_id} for regions "
+                 f"{', '.join(region.name for region in regions)}.")
+
+    with span('quantile', granule=native_id):
+        if not tile_quantiles:
+            quantile_low, quantile_high = granule_quantiles(data, aoi, src_crs, quantile_method, quantile_scope)
+        logging.info(f"Quantiles for wse: low={quantile_low}, high={quantile_high}")
+        if np.isnan(quantile_low):
+            logging.warning(f"File {native_id} has no wse values in the {quantile_scope} quantile scope. Skipping.")
+            return []
+        # The cache warps the untrimmed tile or window grid; everything else uses the trimmed data
+        indexers = quantile_drop_indexers(data['wse'].values, data['wse'].dims, quantile_low, quantile_high)
+        data = apply_quantile_filter(data, quantile_low, quantile_high, drop=False)
+        trimmed = data.isel(indexers)
+    data.rio.write_crs(src_crs, inplace=True)
+    trimmed.rio.write_crs(src_crs, inplace=True)
+
+    outputs = []
+    # Regions that share an output CRS share the reprojection
+    reprojected = {src_crs: trimmed}
+    for region in regions:
+        if region.crs not in reprojected:
+            logging.info(f"Reprojecting {native_id} from {src_crs} to {region.crs}.")
+            with span('reproject', granule=native_id, src_crs=src_crs, dst_crs=region.crs) as s:
+                if reprojection_cache is not None:
+                    reprojected[region.crs] = drop_empty(reproject(data, region.crs, reprojection_cache))
+                else:
+                    reprojected[region.crs] = reproject(trimmed, region.crs)
+                s.set(pixels=reprojected[region.crs].sizes['y'] * reprojected[region.crs].sizes['x'])
+        try:
+            with span('clip', granule=native_id, region=region.name) as s:
+                clipped = reprojected[region.crs].rio.clip(region.polygons.geometry, region.polygons.crs)
+                clipped = clipped[variables if windowed else ['wse']]
+                s.set(pixels=clipped.sizes['y'] * clipped.sizes['x'])
+        except NoDataInBounds as e:
+            logging.warning(f"No data of {native_id} in region {region.name}: {e}")
+            continue
+        os.makedirs(region.output_dir, exist_ok=True)
+        outputs.append(write_output(clipped, region.output_path(os.path.basename(output_path)), native_id,
+                                    output_options))
+    return outputs
+
+
+def process_remote(granule, local_path, native_id, output_path, geojson_utm, process=process_granule_windowed,
+                   download=earthaccess.download, retries=3, catalog=None, run_id=None):
+    """
+    Process a granule by reading its AOI window from the server with byte-range requests,
+    falling back to downloading the whole granule into local_path if the server cannot serve ranges.
+    A fallback download is recorded in the catalog like any other download.
+    """
+    url = granule.data_links()[0]
+    try:
+        with span('stream', granule=native_id) as s:
+            with open_remote(url) as f:
+                output = process(local_path, native_id, output_path, geojson_utm, source=f)
+                fetched, size = fetched_bytes(f), f.size
+            s.set(bytes=fetched, size=size)
+        logging.info(f"Read {fetched / 1024 ** 2:.1f} of {size / 1024 ** 2:.1f} MB of {native_id} with range requests.")
+        return output
+    except RangeReadsUnsupported as e:
+        logging.warning(f"{e}; downloading the whole granule instead.")
+
+    try:
+        download_granule(granule, local_path, download=download, retries=retries)
+        record_download(catalog, run_id, native_id, local_path)
+        return process(local_path, native_id, output_path, geojson_utm)
+    finally:
+        remove_download(local_path)
+
+
+class CatalogUpdates:
+    """
+    Stand-in for the granule catalog in a worker process, which cannot share the parent's SQLite
+    connection: it collects the mark() calls so the parent can apply them.
+    """
+
+    def __init__(self):
+        self.updates = []
+
+    def mark(self, native_id, status, run_id, **fields):
+        self.updates.append((native_id, status, run_id, fields))
+
+
+def process_remote_in_worker(*args, **kwargs):
+    """
+    process_remote for a process pool worker. Returns (output, catalog updates) so that the parent
+    records a fallback download in the catalog.
+    """
+    updates = CatalogUpdates()
+    return process_remote(*args, catalog=updates, **kwargs), updates.updates
+
+
+def write_output(wse_filtered, output_path, native_id, output_options=None):
+    """
+    Write a filtered granule and its stats sidecar, and return the path written.
+    """
+    with span('write', granule=native_id) as s:
+        output_path = write_wse(wse_filtered, output_path, **(output_options or {}))
+        stats = compute_stats(wse_filtered['wse'], output_path, native_id)
+        write_stats(output_path, stats)
+        s.set(pixels=stats['valid_count'], bytes=path_size(output_path))
+    logging.info(f"Saved filtered data to {output_path}")
+    return output_path
+
+
+def remove_download(local_path):
+    """
+    Delete the download folder of a granule once it has been processed.
+    """
+    if os.path.isdir(local_path):
+        try:
+            shutil.rmtree(local_path)
+            logging.info(f"Deleted the directory and its contents: {local_path}")
+        except PermissionError as e:
+            logging.warning(f"Permission error while deleting {local_path}: {e}")
+    else:
+        logging.warning(f"Directory not found: {local_path}")
+
+
+def record_status(catalog, run_id, native_id, status, **fields):
+    """
+    Update the granule catalog, if one is in use.
+    """
+    if catalog is not None:
+        catalog.mark(native_id, status, run_id, **fields)
+
+
+def record_download(catalog, run_id, native_id, local_path):
+    if catalog is not None:
+        checksum = file_checksum(f'{local_path}/{native_id}.nc')
+        catalog.mark(native_id, 'downloaded', run_id, download_checksum=checksum)
+
+
+def record_result(catalog, run_id, native_id, output):
+    if catalog is None:
+        return
+    # One output per region with process_granule_regions
+    outputs = output if isinstance(output, list) else [output] if output is not None else []
+    if not outputs:
+        catalog.mark(native_id, 'skipped', run_id, error=None)
+    else:
+        catalog.mark_processed(native_id, run_id, [(path, file_checksum(path)) for path in outputs])
+
+
+def append_to_datacube(path, outputs, geojson_file, crs=utm45_crs):
+    """
+    Append the new outputs to the persistent WSE datacube, created on the AOI grid if needed.
+    Granules already in the cube are left alone.
+    """
+    # zarr is only needed when the datacube is used
+    from WSE_Datacube import WSEDatacube
+
+    cube = WSEDatacube(path, None if os.path.exists(path) else AOIGrid.from_geojson(geojson_file, crs))
+    added = 0
+    for output in outputs:
+        try:
+            with span('datacube', file=os.path.basename(output)):
+                added += cube.append_file(output)
         except Exception as e:
-            logging.error(f"Error while clipping data for {native_id}: {e}")
+            logging.error(f"Error while appending {output} to the datacube: {e}")
+    logging.info(f"Appended {added} of {len(outputs)} granules to {path} ({len(cube)} in total).")
+
+
+def log_finished(date_obj):
+    # Add a big log entry when finished with a granule
+    logging.info("*******************************************************")
+    logging.info(f"Finished processing granule for date: {date_obj.strftime('%Y-%m-%d')}")
+    logging.info("*******************************************************")
+
+
+def run_sequential(filtered_results, geojson_utm, download=earthaccess.download, retries=3,
+                   process=process_granule, catalog=None, run_id=None, ingest='download'):
+    """
+    Download and process the granules one at a time.
+    With ingest='stream' the granules are read remotely instead (see process_remote).
+    """
+    outputs = []
+    for date_obj, granule in filtered_results:
+        local_path, native_id, output_path = granule_paths(date_obj, granule)
+        try:
+            record_status(catalog, run_id, native_id, 'downloading')
+            if ingest == 'stream':
+                output = process_remote(granule, local_path, native_id, output_path, geojson_utm, process=process,
+                                        download=download, retries=retries, catalog=catalog, run_id=run_id)
+            else:
+                download_granule(granule, local_path, download=download, retries=retries)
+                record_download(catalog, run_id, native_id, local_path)
+                output = process(local_path, native_id, output_path, geojson_utm)
+            record_result(catalog, run_id, native_id, output)
+        except Exception as e:
+            logging.error(f"Error while processing {native_id}: {e}")
+            record_status(catalog, run_id, native_id, 'failed', error=str(e))
+            continue
+        finally:
+            # Delete the original NetCDF file, also of skipped and failed granules
+            # (process_remote cleans up after itself)
+            if ingest != 'stream':
+                remove_download(local_path)
+        if not output:
             continue
 
-        output_path = f"{data_path}/Filtered_Data/SWOT_BD_{date_obj.strftime('%Y%m%d')}_{native_id.split('x_x_x_')[1].split('F')[0]}_wse.nc"
-        wse_filtered.to_netcdf(output_path)
-        logging.info(f"Saved filtered data to {output_path}")
+        outputs.extend(output if isinstance(output, list) else [output])
+        log_finished(date_obj)
 
-        # Close the dataset
-        ds.close()
+    return outputs
+
+
+def run_pipelined(filtered_results, geojson_utm, workers, download=earthaccess.download, retries=3, max_pending=None,
+                  process=process_granule, catalog=None, run_id=None, ingest='download'):
+    """
+    Download granules on a thread pool and process them on a process pool as they arrive.
+    At most `max_pending` granules (default 2 x workers) sit on disk at once; a new download
+    only starts once an earlier granule has been processed and its folder deleted.
+    With ingest='stream' the process pool reads the granules remotely instead (see process_remote).
+    """
+    max_pending = max_pending or 2 * workers
+    slots = threading.BoundedSemaphore(max_pending)
+    lock = threading.Lock()
+    process_futures = []
+    outputs = []
 
-        # Delete the original NetCDF file
-        if os.path.isdir(local_path):
-            try:
-                shutil.rmtree(local_path)
-                logging.info(f"Deleted the directory and its contents: {local_path}")
-            except PermissionError as e:
-                logging.warning(f"Permission error while deleting {local_path}: {e}")
+    def finish(future, date_obj, native_id, local_path):
+        try:
+            output = future.result()
+            if ingest == 'stream':
+                output, updates = output
+                for update_id, status, update_run, fields in updates:
+                    record_status(catalog, update_run, update_id, status, **fields)
+            record_result(catalog, run_id, native_id, output)
+            if output:
+                with lock:
+                    outputs.extend(output if isinstance(output, list) else [output])
+                log_finished(date_obj)
+        except Exception as e:
+            logging.error(f"Error while processing {native_id}: {e}")
+            record_status(catalog, run_id, native_id, 'failed', error=str(e))
+        finally:
+            if ingest != 'stream':
+                remove_download(local_path)
+            slots.release()
+
+    def submit(process_pool, date_obj, native_id, local_path, *args, **kwargs):
+        try:
+            future = process_pool.submit(*args, **kwargs)
+        except Exception as e:
+            # A broken pool (e.g. after a worker was killed for running out of memory) takes no more work
+            logging.error(f"Could not hand {native_id} to the process pool: {e}")
+            record_status(catalog, run_id, native_id, 'failed', error=str(e))
+            if ingest != 'stream':
+                remove_download(local_path)
+            slots.release()
+            return
+        future.add_done_callback(lambda f: finish(f, date_obj, native_id, local_path))
+        with lock:
+            process_futures.append(future)
+
+    def fetch(date_obj, granule, process_pool):
+        local_path, native_id, output_path = granule_paths(date_obj, granule)
+        if ingest == 'stream':
+            record_status(catalog, run_id, native_id, 'downloading')
+            submit(process_pool, date_obj, native_id, local_path, process_remote_in_worker, granule, local_path,
+                   native_id, output_path, geojson_utm, process=process, download=download, retries=retries,
+                   run_id=run_id)
+            return
+        try:
+            record_status(catalog, run_id, native_id, 'downloading')
+            download_granule(granule, local_path, download=download, retries=retries)
+            record_download(catalog, run_id, native_id, local_path)
+        except Exception as e:
+            logging.error(f"Giving up on {native_id} after {retries} download attempts: {e}")
+            record_status(catalog, run_id, native_id, 'failed', error=str(e))
+            remove_download(local_path)
+            slots.release()
+            return
+        submit(process_pool, date_obj, native_id, local_path, process, local_path, native_id, output_path, geojson_utm)
+
+    with ProcessPoolExecutor(max_workers=workers) as process_pool, \
+            ThreadPoolExecutor(max_workers=workers) as download_pool:
+        download_futures = []
+        for date_obj, granule in filtered_results:
+            # Block here until a slot frees up so downloads cannot outrun processing
+            slots.acquire()
+            download_futures.append(download_pool.submit(fetch, date_obj, granule, process_pool))
+        wait(download_futures)
+        for future in download_futures:
+            if future.exception() is not None:
+                logging.error(f"Error while fetching a granule: {future.exception()}")
+        with lock:
+            pending = list(process_futures)
+        wait(pending)
+
+    return outputs
+
+
+def check_runners(workers=2):
+    """
+    Run run_sequential and run_pipelined on synthetic granules (Synthetic_SWOT.py), searched and
+    downloaded through stand-ins for earthaccess.search_data and earthaccess.download, one of which
+    always fails. Both runners must write the same outputs, record every granule in the catalog and
+    leave nothing in Downloaded_Data.
+    """
+    global data_path
+    import tempfile
+    from collections import Counter
+    from Synthetic_SWOT import write_archive, archive_search, ArchiveDownload
+
+    folder = tempfile.mkdtemp(prefix='swot_runners_')
+    saved_data_path = data_path
+    try:
+        archive = os.path.join(folder, 'Archive')
+        granules = write_archive(archive, 6, 2, size=600)
+        results = search_granules('2024-01-01', '2024-01-31', search_data=archive_search(granules))
+        assert len(results) == len(granules)
+        broken = results[0][1].get('meta')['native-id']
+        archive_download = ArchiveDownload(archive)
+
+        def download(url, local_path):
+            if broken in url:
+                raise OSError("stand-in download failure")
+            return archive_download(url, local_path)
+
+        aoi = gpd.read_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'east-bengal.geojson'))
+        geojson_utm = aoi.to_crs(utm45_crs)
+        written = {}
+        for runner in ('sequential', 'pipelined'):
+            data_path = os.path.join(folder, runner)
+            for subfolder in ('Downloaded_Data', 'Filtered_Data'):
+                os.makedirs(os.path.join(data_path, subfolder))
+            catalog = GranuleCatalog(os.path.join(data_path, 'granule_catalog.sqlite'))
+            run_id = catalog.start_run()
+            for date_obj, granule in results:
+                catalog.register(granule.get('meta')['native-id'], date_obj, granule.data_links()[0])
+            if runner == 'sequential':
+                outputs = run_sequential(results, geojson_utm, download=download, retries=1, catalog=catalog,
+                                         run_id=run_id)
+            else:
+                outputs = run_pipelined(results, geojson_utm, workers, download=download, retries=1,
+                                        catalog=catalog, run_id=run_id)
+            statuses = {row['native_id']: row['status'] for row in catalog.conn.execute("SELECT * FROM granules")}
+            catalog.close()
+            assert statuses.pop(broken) == 'failed'
+            assert set(statuses.values()) <= {'processed', 'skipped'}
+            assert not os.listdir(os.path.join(data_path, 'Downloaded_Data'))
+            written[runner] = {os.path.basename(output): xr.load_dataset(output) for output in outputs}
+            print(f"{runner}: {len(outputs)} outputs; {dict(Counter(statuses.values()))} and 1 failed download")
+        assert written['sequential'].keys() == written['pipelined'].keys()
+        for name, ds in written['sequential'].items():
+            xr.testing.assert_identical(ds, written['pipelined'][name])
+        print("Both runners wrote identical outputs")
+    finally:
+        data_path = saved_data_path
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download and filter SWOT WSE rasters.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of download/process workers. 1 runs the granules one at a time.")
+    parser.add_argument('--retries', type=int, default=3, help="Download attempts per granule.")
+    parser.add_argument('--catalog', default=f"{data_path}/granule_catalog.sqlite",
+                        help="SQLite granule catalog used to skip granules that were already processed.")
+    parser.add_argument('--max-attempts', type=int, default=5,
+                        help="Stop retrying a failed granule after this many attempts (0 retries it on every run).")
+    parser.add_argument('--no-catalog', action='store_true',
+                        help="Process every granule found by the search, as before the catalog existed.")
+    parser.add_argument('--mode', choices=['full', 'windowed'], default='full',
+                        help="'full' filters and reprojects the whole tile before clipping; "
+                             "'windowed' reads only the AOI window and reprojects the clipped subset.")
+    parser.add_argument('--quantile-method', choices=['exact', 'histogram'], default='exact',
+                        help="'exact' matches xarray's quantile; 'histogram' reads wse in blocks and is "
+                             "accurate to one histogram bin.")
+    parser.add_argument('--quantile-scope', choices=['tile', 'window', 'aoi'], default=None,
+                        help="Pixels the 5-95%% quantiles are taken over. Defaults to 'tile' in full mode "
+                             "and 'window' in windowed mode.")
+    parser.add_argument('--variables', nargs='+', default=['wse'],
+                        help="Variables to keep in windowed mode (wse is always kept).")
+    parser.add_argument('--output-format', choices=['netcdf', 'zarr'], default='netcdf',
+                        help="Store of the filtered outputs.")
+    parser.add_argument('--compression', choices=['zlib', 'zstd', 'none'], default='zlib',
+                        help="Compression of NetCDF outputs.")
+    parser.add_argument('--output-dtype', choices=['float32', 'int16'], default='float32',
+                        help="'int16' quantizes wse to about 0.015 m (see Output_Format.py).")
+    parser.add_argument('--chunk-size', type=int, default=256, help="Chunk size of the outputs along y and x.")
+    parser.add_argument('--datacube', default=None, metavar='PATH',
+                        help="Also append every processed granule to the (time, y, x) Zarr datacube at PATH.")
+    parser.add_argument('--ingest', choices=['download', 'stream'], default='download',
+                        help="'stream' reads only the AOI window of each granule over HTTPS with byte-range "
+                             "requests (needs --mode windowed), falling back to a full download.")
+    parser.add_argument('--regions', default=None, metavar='REGISTRY',
+                        help="JSON region registry (see Regions.py). Each granule is read once and clipped "
+                             "outputs are written for every region it touches, instead of the east-bengal AOI.")
+    parser.add_argument('--min-overlap', type=float, default=0.0,
+                        help="Skip granules whose UMM footprint has less than this fraction (0-1) inside the AOI "
+                             "or regions. By default only granules that do not touch them at all are skipped.")
+    parser.add_argument('--reprojection-cache', default=f"{data_path}/Reprojection_Cache", metavar='DIR',
+                        help="Folder of the cached UTM44/UTM46 -> UTM45 gather indices (see Reprojection_Cache.py).")
+    parser.add_argument('--reprojection-cache-size', type=float, default=1.0, metavar='GB',
+                        help="Size the reprojection cache is trimmed to, least recently used entries first.")
+    parser.add_argument('--no-reprojection-cache', action='store_true',
+                        help="Reproject every granule with rio.reproject instead of the cached gather indices.")
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help="Append timing, memory and I/O spans of every stage to FILE as JSON lines and "
+                             "print a summary at the end (same as setting SWOT_TRACE=FILE).")
+    parser.add_argument('--check', action='store_true',
+                        help="Run the sequential and pipelined runners on synthetic granules with stand-in "
+                             "search and download functions, then exit.")
+    args = parser.parse_args(argv)
+    if args.ingest == 'stream' and args.mode != 'windowed':
+        parser.error("--ingest stream reads only the AOI window, so it needs --mode windowed")
+    if args.check:
+        check_runners(max(args.workers, 2))
+        return 'finished'
+
+    print_summary = enable(args.trace)
+    setup_logging()
+    logging.info("Starting the data download and processing script.")
+
+    catalog = None if args.no_catalog else GranuleCatalog(args.catalog)
+    run_id = catalog.start_run() if catalog is not None else None
+    run_status = 'failed'
+
+    try:
+        earthaccess.login(strategy='netrc')
+        end_date = datetime.today().strftime('%Y-%m-%d')
+        start_date = (datetime.today() - timedelta(days=18)).strftime('%Y-%m-%d')
+        logging.info(f"Start date {start_date} and end date {end_date} for granules search.")
+        registry = RegionRegistry.load(args.regions) if args.regions else None
+        geojson_file = rf"{data_path}/Codes/east-bengal.geojson"
+        if registry is not None:
+            filtered_results = search_granules(start_date, end_date, bounding_box=registry.bounding_box())
+            aoi = registry.aoi()
+            # The datacube follows the first region of the registry
+            geojson_file = registry.regions[0].geojson
+        else:
+            filtered_results = search_granules(start_date, end_date)
+            aoi = gpd.read_file(geojson_file)
+
+        # Granules that miss the AOI (or every region) are not fetched
+        filtered_results = prefilter_granules(filtered_results, aoi, args.min_overlap)
+
+        if catalog is not None:
+            # Only fetch granules that are new, failed or were interrupted by an earlier run
+            for date_obj, granule in filtered_results:
+                catalog.register(granule.get('meta')['native-id'], date_obj, granule.data_links()[0])
+            found = len(filtered_results)
+            given_up = [granule.get('meta')['native-id'] for date_obj, granule in filtered_results
+                        if catalog.given_up(granule.get('meta')['native-id'], args.max_attempts)]
+            filtered_results = [(date_obj, granule) for date_obj, granule in filtered_results
+                                if catalog.needs_work(granule.get('meta')['native-id'], args.max_attempts)]
+            logging.info(f"{len(filtered_results)} of {found} granules are new or unfinished (run {run_id}).")
+            if given_up:
+                logging.warning(f"Not retrying {len(given_up)} granules that failed {args.max_attempts} times: "
+                                f"{', '.join(given_up)}")
+
+        # With a registry, the registry is handed to the workers in place of the AOI
+        geojson_utm = registry if registry is not None else aoi.to_crs(utm45_crs)
+
+        output_options = {'store': args.output_format, 'compression': args.compression, 'dtype': args.output_dtype,
+                          'chunks': (args.chunk_size, args.chunk_size)}
+        reprojection_cache = None if args.no_reprojection_cache else \
+            ReprojectionCache(args.reprojection_cache, int(args.reprojection_cache_size * 1024 ** 3))
+        if registry is not None:
+            process = functools.partial(process_granule_regions, windowed=args.mode == 'windowed',
+                                        variables=tuple(args.variables), quantile_method=args.quantile_method,
+                                        quantile_scope=args.quantile_scope, output_options=output_options,
+                                        reprojection_cache=reprojection_cache)
+        elif args.mode == 'windowed':
+            process = functools.partial(process_granule_windowed, variables=tuple(args.variables),
+                                        quantile_method=args.quantile_method,
+                                        quantile_scope=args.quantile_scope or 'window', output_options=output_options,
+                                        reprojection_cache=reprojection_cache)
         else:
-            logging.warning(f"Directory not found: {local_path}")
+            process = functools.partial(process_granule, quantile_method=args.quantile_method,
+                                        quantile_scope=args.quantile_scope or 'tile', output_options=output_options,
+                                        reprojection_cache=reprojection_cache)
+
+        if args.workers > 1:
+            logging.info(f"Running the pipelined download/process mode with {args.workers} workers.")
+            outputs = run_pipelined(filtered_results, geojson_utm, args.workers, retries=args.retries,
+                                    process=process, catalog=catalog, run_id=run_id, ingest=args.ingest)
+        else:
+            outputs = run_sequential(filtered_results, geojson_utm, retries=args.retries, process=process,
+                                     catalog=catalog, run_id=run_id, ingest=args.ingest)
+        if args.datacube:
+            if registry is not None:
+                # Compare paths as strings: the folder of region 0 does not exist if no granule touched it
+                first_dir = os.path.realpath(registry.regions[0].output_dir)
+                outputs = [output for output in outputs if os.path.realpath(os.path.dirname(output)) == first_dir]
+            append_to_datacube(args.datacube, outputs, geojson_file,
+                               registry.regions[0].crs if registry is not None else utm45_crs)
+        run_status = 'finished'
+
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+
+    if catalog is not None:
+        catalog.finish_run(run_id, run_status)
+        catalog.close()
 
-        # Add a big log entry when finished with a granule
-        logging.info("*******************************************************")
-        logging.info(f"Finished processing granule for date: {date_obj.strftime('%Y-%m-%d')}")
-        logging.info("*******************************************************")
+    logging.info("Script finished successfully.")
+    if print_summary:
+        summary()
+    return run_status
 
-except Exception as e:
-    logging.error(f"An error occurred: {e}")
 
-logging.info("Script finished successfully.")
+if __name__ == "__main__":
+    main()
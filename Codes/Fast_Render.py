@@ -0,0 +1,56 @@
+import numpy as np
+import cartopy.crs as ccrs
+import rioxarray  # registers the .rio accessor
+from rioxarray.merge import merge_arrays
+from rasterio.enums import Resampling
+from rasterio.warp import calculate_default_transform
+
+
+def warp_to_map(layers, src_crs="EPSG:32645", dst_crs="EPSG:4326", resolution=None, min_resolution=None):
+    """
+    Merge the UTM layers of one map and warp them once to the map projection (nearest neighbour).
+    Later layers win where they overlap, as in the pcolormesh overlay.
+    min_resolution (e.g. output_resolution) keeps the warp from being finer than the image can show.
+    """
+    prepared = []
+    for data in layers:
+        if data.rio.crs is None:
+            data = data.rio.write_crs(src_crs)
+        prepared.append(data.rio.write_nodata(np.nan))
+    if not prepared:
+        return None
+    # merge_arrays keeps the first valid value, so the newest layer goes first
+    merged = prepared[0] if len(prepared) == 1 else merge_arrays(prepared[::-1], nodata=np.nan)
+    if resolution is None and min_resolution:
+        native = calculate_default_transform(merged.rio.crs, dst_crs, merged.rio.width, merged.rio.height,
+                                             *merged.rio.bounds())[0].a
+        if min_resolution > native:
+            resolution = min_resolution
+    kwargs = {'resolution': resolution} if resolution else {}
+    return merged.rio.reproject(dst_crs, resampling=Resampling.nearest, nodata=np.nan, **kwargs)
+
+
+def draw_raster(ax, data, **kwargs):
+    """
+    Draw a lon/lat DataArray on a PlateCarree GeoAxes as one image.
+    The data is already in the axes projection, so cartopy does not regrid it.
+    kwargs go to imshow (cmap, norm, vmin, vmax, ...).
+    """
+    left, bottom, right, top = data.rio.bounds()
+    values = data.transpose('y', 'x').values
+    if data['y'].values[0] < data['y'].values[-1]:
+        values = values[::-1]
+    return ax.imshow(np.ma.masked_invalid(values), extent=(left, right, bottom, top), origin='upper',
+                     transform=ccrs.PlateCarree(), interpolation='nearest', **kwargs)
+
+
+def output_resolution(ax, dpi):
+    """
+    Size in degrees of one pixel of a PlateCarree GeoAxes saved at dpi. Detail finer than this is
+    dropped again when matplotlib resamples the image, at a cost of memory that grows with it.
+    """
+    x0, x1, y0, y1 = ax.get_extent(ccrs.PlateCarree())
+    position = ax.get_position()
+    width = position.width * ax.figure.get_figwidth() * dpi
+    height = position.height * ax.figure.get_figheight() * dpi
+    return min((x1 - x0) / width, (y1 - y0) / height)
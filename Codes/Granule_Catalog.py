@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+
+# Granules in these states need no more work as long as their output is still on disk
+DONE_STATES = ('processed', 'skipped')
+
+
+def file_checksum(path, block_size=1 << 20):
+    """
+    Return the SHA-256 hex digest of a file, or of all files below a directory (a Zarr store).
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file in files:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class GranuleCatalog:
+    """
+    SQLite catalog of the granules seen by Download_SWOT_Data.py, keyed on the granule native-id.
+
+    Each granule row records its status (found, downloading, downloaded, processed, skipped or
+    failed), the checksums of the downloaded and filtered files, the output path and the run that
+    last touched it. A granule written to several regions has one row per output in the outputs
+    table; the granule row keeps the first. Daily runs use it to fetch only new or failed granules, and later stages can
+    ask which outputs changed since a given run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Callbacks of the pipelined mode update the catalog from worker threads
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    status TEXT NOT NULL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS granules (
+                    native_id TEXT PRIMARY KEY,
+                    granule_date TEXT NOT NULL,
+                    download_url TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    download_checksum TEXT,
+                    output_checksum TEXT,
+                    output_path TEXT,
+                    error TEXT,
+                    run_id INTEGER,
+                    updated_at TEXT NOT NULL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outputs (
+                    native_id TEXT NOT NULL REFERENCES granules (native_id),
+                    output_path TEXT NOT NULL,
+                    output_checksum TEXT,
+                    PRIMARY KEY (native_id, output_path)
+                )""")
+            # Catalogs written before the outputs table existed have their one output on the granule row
+            self.conn.execute("""
+                INSERT OR IGNORE INTO outputs (native_id, output_path, output_checksum)
+                SELECT native_id, output_path, output_checksum FROM granules
+                WHERE status = 'processed' AND output_path IS NOT NULL""")
+
+    def close(self):
+        self.conn.close()
+
+    def start_run(self):
+        """
+        Record the start of a run and return its id.
+        """
+        with self.lock, self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (started_at, status) VALUES (?, 'running')",
+                                       (datetime.now().isoformat(),))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id, status='finished'):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?",
+                              (datetime.now().isoformat(), status, run_id))
+
+    def last_run_id(self, status='finished'):
+        """
+        Return the id of the latest run with the given status, or None.
+        """
+        row = self.conn.execute("SELECT MAX(run_id) FROM runs WHERE status = ?", (status,)).fetchone()
+        return row[0]
+
+    def register(self, native_id, date_obj, download_url):
+        """
+        Add a granule found by the search. Granules already in the catalog keep their state.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT OR IGNORE INTO granules (native_id, granule_date, download_url, status, updated_at)
+                VALUES (?, ?, ?, 'found', ?)""",
+                              (native_id, date_obj.strftime('%Y-%m-%d'), download_url, datetime.now().isoformat()))
+
+    def get(self, native_id):
+        with self.lock:
+            return self.conn.execute("SELECT * FROM granules WHERE native_id = ?", (native_id,)).fetchone()
+
+    def needs_work(self, native_id, max_attempts=None):
+        """
+        True if the granule is new, failed, was interrupted mid-run, or its output has gone missing.
+        A failed granule is given up on once it has been attempted max_attempts times (None: never).
+        """
+        if self.given_up(native_id, max_attempts):
+            return False
+        row = self.get(native_id)
+        if row is None or row['status'] not in DONE_STATES:
+            return True
+        if row['status'] != 'processed':
+            return False
+        paths = self.output_paths(native_id)
+        return not paths or not all(os.path.exists(path) for path in paths)
+
+    def output_paths(self, native_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT output_path FROM outputs WHERE native_id = ? ORDER BY rowid",
+                                     (native_id,)).fetchall()
+        return [row['output_path'] for row in rows]
+
+    def mark_processed(self, native_id, run_id, outputs):
+        """
+        Mark a granule processed with its outputs, a list of (output path, checksum), replacing
+        the outputs of earlier runs. The granule row keeps the first output.
+        """
+        output_path, output_checksum = outputs[0]
+        with self.lock, self.conn:
+            self.conn.execute("""
+                UPDATE granules SET status = 'processed', run_id = ?, updated_at = ?, output_path = ?,
+                    output_checksum = ?, error = NULL
+                WHERE native_id = ?""",
+                              (run_id, datetime.now().isoformat(), output_path, output_checksum, native_id))
+            self.conn.execute("DELETE FROM outputs WHERE native_id = ?", (native_id,))
+            self.conn.executemany("INSERT INTO outputs (native_id, output_path, output_checksum) VALUES (?, ?, ?)",
+                                  [(native_id, path, checksum) for path, checksum in outputs])
+
+    def given_up(self, native_id, max_attempts=None):
+        """
+        True if the granule failed and has been attempted max_attempts times or more.
+        Never true if max_attempts is None or 0.
+        """
+        row = self.get(native_id)
+        return bool(max_attempts) and row is not None and row['status'] == 'failed' and row['attempts'] >= max_attempts
+
+    def mark(self, native_id, status, run_id, **fields):
+        """
+        Set the status of a granule, plus any of download_checksum, output_checksum, output_path and error.
+        """
+        allowed = {'download_checksum', 'output_checksum', 'output_path', 'error'}
+        unknown = set(fields) - allowed
+        if unknown:
+            raise ValueError(f"Unknown catalog fields: {sorted(unknown)}")
+        assignments = ''.join(f", {name} = ?" for name in fields)
+        if status == 'downloading':
+            # Count every download attempt
+            assignments += ", attempts = attempts + 1"
+        with self.lock, self.conn:
+            self.conn.execute(f"""
+                UPDATE granules SET status = ?, run_id = ?, updated_at = ?{assignments}
+                WHERE native_id = ?""",
+                              [status, run_id, datetime.now().isoformat()] + list(fields.values()) + [native_id])
+
+    def changed_since(self, run_id=None):
+        """
+        Return the outputs written after run `run_id` (all of them if None), one row per output with
+        the columns of its granule; output_path and output_checksum are those of the output.
+        """
+        query = """
+            SELECT granules.*, outputs.output_path, outputs.output_checksum
+            FROM outputs JOIN granules USING (native_id) WHERE granules.status = 'processed'"""
+        params = []
+        if run_id is not None:
+            query += " AND granules.run_id > ?"
+            params.append(run_id)
+        return self.conn.execute(query + " ORDER BY granule_date, native_id, outputs.rowid", params).fetchall()
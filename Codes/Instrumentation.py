@@ -0,0 +1,170 @@
+"""
+Lightweight timing, memory and I/O instrumentation for the pipeline scripts.
+
+Code is wrapped in named spans:
+
+    with span('reproject', granule=native_id) as s:
+        ...
+        s.set(pixels=count)
+
+When tracing is on, every span appends one JSON line to the trace file with its duration,
+the current RSS, the peak RSS of the process so far (the high-water mark never goes down, so it
+is not the peak of the span itself), bytes read and written by the process during the span,
+any fields set on it and the error if it raised. Turn it on with the SWOT_TRACE=<file> environment variable
+or the --trace <file> option of the scripts; worker processes inherit it. When it
+is off, span() returns a shared no-op object, so the instrumented code runs as before.
+summary() prints a table of the spans of the current run.
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from collections import defaultdict
+
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(os.environ.get('SWOT_TRACE'))
+
+
+def enable(path=None):
+    """
+    Turn tracing on into path, or into $SWOT_TRACE if path is None, for this process and the
+    processes it starts, which share one run id. Returns True if this call started the run, in
+    which case the caller prints the summary; False if tracing is off or a caller (such as
+    Run_Pipeline.py) already started it.
+    """
+    path = path or os.environ.get('SWOT_TRACE')
+    if not path:
+        return False
+    os.environ['SWOT_TRACE'] = os.path.abspath(path)
+    if os.environ.get('SWOT_TRACE_RUN'):
+        return False
+    os.environ['SWOT_TRACE_RUN'] = f"{datetime.now():%Y%m%dT%H%M%S}_{os.getpid()}"
+    return True
+
+
+def process_memory():
+    """
+    Current resident memory of this process and its peak since the process started in MB (Linux),
+    or None elsewhere.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def io_bytes():
+    """
+    Bytes read and written by this process so far (Linux /proc/self/io), or zeros elsewhere.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+class Span:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.started = datetime.now()
+        self.io_start = io_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        read, written = io_bytes()
+        rss, process_peak_rss = process_memory()
+        record = {
+            'run': os.environ.get('SWOT_TRACE_RUN'),
+            'span': self.name,
+            'start': self.started.isoformat(timespec='milliseconds'),
+            'duration_s': round(duration, 6),
+            'rss_mb': rss,
+            'process_peak_rss_mb': process_peak_rss,
+            'read_bytes': read - self.io_start[0],
+            'written_bytes': written - self.io_start[1],
+            'pid': os.getpid(),
+        }
+        record.update(self.fields)
+        if exc is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+        path = os.environ.get('SWOT_TRACE')
+        if path:
+            line = json.dumps(record, default=str) + '\n'
+            with _lock, open(path, 'a') as f:
+                f.write(line)
+        return False
+
+
+class NoSpan:
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+no_span = NoSpan()
+
+
+def span(name, **fields):
+    """
+    Context manager timing the code inside it; a no-op unless tracing is on.
+    """
+    if not os.environ.get('SWOT_TRACE'):
+        return no_span
+    return Span(name, fields)
+
+
+def summary(path=None, run=None):
+    """
+    Print the count, total/mean/max duration, highest process peak RSS and bytes read/written of
+    every span name in the trace file, for the current run by default.
+    """
+    path = path or os.environ.get('SWOT_TRACE')
+    run = run or os.environ.get('SWOT_TRACE_RUN')
+    if not path or not os.path.exists(path):
+        return
+    totals = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0, 'peak': 0.0, 'read': 0, 'written': 0,
+                                  'errors': 0})
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if run and record.get('run') != run:
+                continue
+            entry = totals[record['span']]
+            entry['count'] += 1
+            entry['total'] += record['duration_s']
+            entry['max'] = max(entry['max'], record['duration_s'])
+            entry['peak'] = max(entry['peak'], record.get('process_peak_rss_mb') or 0)
+            entry['read'] += record.get('read_bytes', 0)
+            entry['written'] += record.get('written_bytes', 0)
+            entry['errors'] += 'error' in record
+
+    print(f"{'span':<20} {'count':>6} {'total s':>9} {'mean s':>8} {'max s':>8} {'proc peak MB':>12} "
+          f"{'read MB':>8} {'written MB':>10} {'errors':>6}")
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]['total']):
+        print(f"{name:<20} {entry['count']:6d} {entry['total']:9.2f} {entry['total'] / entry['count']:8.3f} "
+              f"{entry['max']:8.3f} {entry['peak']:12.0f} {entry['read'] / 1024 ** 2:8.1f} "
+              f"{entry['written'] / 1024 ** 2:10.1f} {entry['errors']:6d}")
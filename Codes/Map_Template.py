@@ -0,0 +1,99 @@
+import os
+import matplotlib.pyplot as plt
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+from Basemap_Cache import add_basemap
+from Instrumentation import span
+
+map_extent = [89.68961819451815, 96.1684430301529, 17.004581710046345, 25.77955529545101]
+
+
+def add_scalebar(ax, length_in_km, location=(0.1, 0.05), linewidth=3):
+    """
+    Add a scale bar to the map.
+    """
+    # Get the x and y axis limits (extent of the map in lat/lon)
+    x0, x1 = ax.get_xlim()
+    y0, y1 = ax.get_ylim()
+
+    # Calculate the scale bar length in degrees based on the scale (approx 1 degree = 111 km at equator)
+    scale_length_deg = length_in_km / 111  # 111 km per degree
+
+    # Calculate the position for the scale bar (adjust to be within the plot)
+    x_start = x0 + (x1 - x0) * location[0]
+    y_start = y0 + (y1 - y0) * location[1]
+
+    # Draw the scale bar and its label
+    ax.plot([x_start, x_start + scale_length_deg], [y_start, y_start], color='black', linewidth=linewidth, transform=ccrs.PlateCarree())
+    ax.text((x_start + x_start + scale_length_deg) / 2, y_start + 0.02, f'{length_in_km} km',
+            ha='center', va='bottom', fontsize=10, transform=ccrs.PlateCarree())
+
+
+class MapTemplate:
+    """
+    Map figure whose static layers are drawn once per run: basemap, coastlines, borders, gridlines,
+    the discrete colorbar, north arrow and scale bar. render() adds the data layer of one date,
+    sets the title, saves the image and removes the data again, so the same figure serves every
+    date and memory stays flat over long backfills.
+    With offline=True basemap tiles that are not cached are drawn blank instead of downloaded.
+    """
+
+    def __init__(self, cmap, norm, boundaries, extent=map_extent, figsize=(12, 8), basemap=True, offline=False):
+        self.extent = extent
+
+        # Set up the map projection and axes
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.add_subplot(projection=ccrs.PlateCarree())
+        ax = self.ax
+
+        if basemap:
+            # Add the OpenStreetMap basemap, coastlines and borders
+            add_basemap(ax, 10, offline=offline)
+            ax.coastlines()
+            ax.add_feature(cfeature.BORDERS, linestyle=':')
+
+        # Set extent (latitude and longitude bounds)
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        gridlines = ax.gridlines(draw_labels=True, linestyle=':', color='gray', alpha=0.7)
+        gridlines.top_labels = False  # Turn off labels at the top
+        gridlines.right_labels = False  # Turn off labels on the right
+
+        # Add a colorbar with the discrete ranges
+        sm = plt.cm.ScalarMappable(cmap=cmap, norm=norm)
+        sm.set_array([])  # Empty array for colorbar mapping
+        cbar = self.fig.colorbar(sm, ax=ax, orientation='vertical', pad=0.02, label='Water Surface Elevation (wse)')
+        cbar.set_ticks(boundaries)  # Place ticks at the boundaries
+        tick_labels = [f'{b:.0f}m' for b in boundaries[:-1]]  # Set all except the last label
+        tick_labels.append(f'>{boundaries[-1]:.0f}m')  # Append '>1600m' for the last label
+        cbar.set_ticklabels(tick_labels)
+
+        # Adding North Arrow
+        ax.annotate('N', xy=(0.9, 0.95), xytext=(0.9, 0.9),
+                    arrowprops=dict(facecolor='black', width=5, headwidth=15),
+                    ha='center', va='center', fontsize=12,
+                    xycoords=ax.transAxes)
+
+        # Adding Scale Bar
+        add_scalebar(ax, length_in_km=100, location=(0.1, 0.05))
+
+    def render(self, draw, title, save_path, dpi=1200):
+        """
+        Call draw(ax) to add the data layer (it returns the artists it added), save the figure
+        with the given title, then remove the data layer again.
+        """
+        with span('draw'):
+            artists = draw(self.ax) or []
+        try:
+            self.ax.set_title(title)
+            # Plotting can move the limits, so restore the fixed extent before saving
+            self.ax.set_extent(self.extent, crs=ccrs.PlateCarree())
+            with span('savefig', file=os.path.basename(save_path), dpi=dpi) as s:
+                self.fig.savefig(save_path, dpi=dpi, bbox_inches='tight')
+                s.set(bytes=os.path.getsize(save_path))
+        finally:
+            for artist in artists:
+                artist.remove()
+        return save_path
+
+    def close(self):
+        plt.close(self.fig)
@@ -0,0 +1,168 @@
+import numpy as np
+from collections import deque
+from datetime import timedelta
+
+
+class SlidingComposite:
+    """
+    N-day composite on a fixed AOIGrid that is updated as the window slides.
+
+    Granules are added once, oldest date first, as sparse (flat index, value) layers from
+    AOIGrid.resample. expire() drops the layers that fell out of the window, so consecutive
+    windows reuse the layers they share instead of reading them again.
+
+    The composite is kept in square blocks of block_size x block_size grid pixels. A block is
+    allocated when a granule first covers it and freed once no layer covers it any more, so
+    memory follows the area covered by the window rather than the whole AOI grid.
+
+    method is 'latest' (the most recent valid value wins), 'mean' or 'median'. Latest and mean
+    are kept up to date incrementally; the median is worked out over the covered pixels on demand.
+    """
+
+    def __init__(self, grid, days=10, method='latest', block_size=512):
+        if method not in ('latest', 'mean', 'median'):
+            raise ValueError(f"Unknown composite method: {method}")
+        self.grid = grid
+        self.days = days
+        self.method = method
+        self.block_size = block_size
+        self.blocks_x = -(-grid.shape[1] // block_size)
+        self.layers = deque()  # (date, sequence, pieces), oldest first; see split()
+        self.sequence = 0
+        # Block id -> state of that block: (value, owner) for latest, (total, count) for mean
+        self.blocks = {}
+
+    def split(self, flat_index, values):
+        """
+        Group the pixels of a layer by block: a list of (block id, offsets in the block, values).
+        """
+        if flat_index.size == 0:
+            return []
+        rows, cols = np.divmod(flat_index, self.grid.shape[1])
+        block = (rows // self.block_size) * self.blocks_x + cols // self.block_size
+        offset = ((rows % self.block_size) * self.block_size + cols % self.block_size).astype(np.int32)
+        order = np.argsort(block, kind='stable')
+        block, offset, values = block[order], offset[order], values[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(block)) + 1])
+        return [(int(block[start]), offsets, block_values) for start, offsets, block_values
+                in zip(starts, np.split(offset, starts[1:]), np.split(values, starts[1:]))]
+
+    def new_block(self):
+        pixels = self.block_size * self.block_size
+        if self.method == 'latest':
+            # Owner 0 means no layer; sequences start at 1
+            return np.full(pixels, np.nan, dtype=np.float32), np.zeros(pixels, dtype=np.int32)
+        return np.zeros(pixels, dtype=np.float64), np.zeros(pixels, dtype=np.int32)
+
+    def add(self, date, flat_index, values):
+        """
+        Add one resampled granule. Dates must not go backwards; granules of the same date
+        are layered in the order they are added.
+        """
+        if self.layers and date < self.layers[-1][0]:
+            raise ValueError(f"Granule date {date} is older than the newest layer {self.layers[-1][0]}")
+        self.sequence += 1
+        pieces = self.split(flat_index, values)
+        self.layers.append((date, self.sequence, pieces))
+        if self.method == 'median':
+            return
+        for block, offsets, block_values in pieces:
+            if block not in self.blocks:
+                self.blocks[block] = self.new_block()
+            if self.method == 'latest':
+                value, owner = self.blocks[block]
+                value[offsets] = block_values
+                owner[offsets] = self.sequence
+            else:
+                total, count = self.blocks[block]
+                total[offsets] += block_values
+                count[offsets] += 1
+
+    def expire(self, target_date):
+        """
+        Drop the layers older than target_date - days. Returns the number of layers dropped.
+        """
+        cutoff = target_date - timedelta(days=self.days)
+        expired = []
+        while self.layers and self.layers[0][0] < cutoff:
+            expired.append(self.layers.popleft())
+        if not expired or self.method == 'median':
+            return len(expired)
+
+        touched = set()
+        for date, sequence, pieces in expired:
+            for block, offsets, block_values in pieces:
+                touched.add(block)
+                if self.method == 'latest':
+                    # Every remaining layer is newer than the expired ones, so a pixel an expired
+                    # layer still owns is not covered by any remaining layer and becomes empty
+                    value, owner = self.blocks[block]
+                    owned = offsets[owner[offsets] == sequence]
+                    value[owned] = np.nan
+                    owner[owned] = 0
+                else:
+                    total, count = self.blocks[block]
+                    total[offsets] -= block_values
+                    count[offsets] -= 1
+        for block in touched:
+            if not self.blocks[block][1].any():
+                del self.blocks[block]
+        return len(expired)
+
+    @property
+    def dates(self):
+        return [layer[0] for layer in self.layers]
+
+    def composite(self):
+        """
+        Return the composite as a list of georeferenced DataArrays, one per covered block, each
+        cropped to its valid pixels.
+        """
+        if self.method == 'latest':
+            arrays = {block: value.copy() for block, (value, owner) in self.blocks.items()}
+        elif self.method == 'mean':
+            arrays = {}
+            for block, (total, count) in self.blocks.items():
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = (total / count).astype(np.float32)
+                mean[count == 0] = np.nan
+                arrays[block] = mean
+        else:
+            arrays = self.median()
+        return [self.block_dataarray(block, arrays[block]) for block in sorted(arrays)
+                if not np.isnan(arrays[block]).all()]
+
+    def median(self):
+        """
+        Median of every block over the pixels covered by at least one layer.
+        """
+        pieces_by_block = {}
+        for date, sequence, pieces in self.layers:
+            for block, offsets, block_values in pieces:
+                pieces_by_block.setdefault(block, []).append((offsets, block_values))
+        arrays = {}
+        for block, pieces in pieces_by_block.items():
+            covered = np.unique(np.concatenate([offsets for offsets, block_values in pieces]))
+            stack = np.full((len(pieces), covered.size), np.nan, dtype=np.float32)
+            for i, (offsets, block_values) in enumerate(pieces):
+                stack[i, np.searchsorted(covered, offsets)] = block_values
+            result = np.full(self.block_size * self.block_size, np.nan, dtype=np.float32)
+            result[covered] = np.nanmedian(stack, axis=0)
+            arrays[block] = result
+        return arrays
+
+    def block_dataarray(self, block, array):
+        row0 = (block // self.blocks_x) * self.block_size
+        col0 = (block % self.blocks_x) * self.block_size
+        height = min(self.block_size, self.grid.shape[0] - row0)
+        width = min(self.block_size, self.grid.shape[1] - col0)
+        array = array.reshape(self.block_size, self.block_size)[:height, :width]
+        # Crop to the valid pixels, keeping at least 2 rows and columns so the resolution of the
+        # block can still be worked out from its coordinates
+        valid = ~np.isnan(array)
+        rows = np.flatnonzero(valid.any(axis=1))
+        cols = np.flatnonzero(valid.any(axis=0))
+        row_start, col_start = min(rows[0], max(height - 2, 0)), min(cols[0], max(width - 2, 0))
+        row_stop, col_stop = max(rows[-1] + 1, row_start + 2), max(cols[-1] + 1, col_start + 2)
+        return self.grid.to_dataarray(array[row_start:row_stop, col_start:col_stop], crop=False,
+                                      origin=(row0 + row_start, col0 + col_start))
@@ -0,0 +1,119 @@
+"""
+Encoding of the filtered wse outputs.
+
+Filtered granules are mostly NaN outside water, so they are written compressed and chunked:
+
+    float32  lossless; zlib (default) or zstd compressed NetCDF4, or 'none' for the old layout
+    int16    wse stored as int16 with scale_factor 0.03 m and add_offset 800 m, so the range is
+             -183 m to 1783 m and every value is within about 0.015 m of the float32 one
+             (SWOT WSE itself is accurate to about 0.1 m). Granules with values outside the
+             range are written as float32.
+    zarr     the same encodings in a Zarr store (needs the zarr package)
+
+Readers open the outputs lazily, so only the chunks they touch are decompressed.
+"""
+import os
+import logging
+import numpy as np
+import xarray as xr
+
+output_extensions = ('.nc', '.zarr')
+
+int16_scale = np.float32(0.03)
+int16_offset = np.float32(800.0)
+int16_fill = np.int16(-32768)
+
+
+def is_wse_output(file):
+    return file.endswith(output_extensions)
+
+
+def store_path(output_path, store='netcdf'):
+    """
+    Return output_path with the extension of the store.
+    """
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.zarr" if store == 'zarr' else f"{root}.nc"
+
+
+def fits_int16(values):
+    """
+    True if all valid values can be stored with the int16 scale and offset.
+    """
+    values = np.asarray(values)
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return True
+    low = (values.min() - int16_offset) / int16_scale
+    high = (values.max() - int16_offset) / int16_scale
+    return low >= np.iinfo(np.int16).min + 1 and high <= np.iinfo(np.int16).max
+
+
+def wse_encoding(ds, store='netcdf', compression='zlib', complevel=4, chunks=(256, 256), dtype='float32'):
+    """
+    Build the encoding of every data variable of ds. chunks are the (y, x) chunk sizes;
+    with dtype='int16' the wse variable is quantized (see the module docstring).
+    """
+    encoding = {}
+    for name, variable in ds.data_vars.items():
+        sizes = {'y': chunks[0], 'x': chunks[1]}
+        chunk_shape = tuple(max(1, min(sizes.get(dim, 1), size)) for dim, size in variable.sizes.items())
+        if store == 'zarr':
+            # Zarr stores are always chunked and use the compressor of the zarr version
+            var_encoding = {'chunks': chunk_shape}
+        elif compression == 'none':
+            var_encoding = {}
+        else:
+            var_encoding = {'compression': compression, 'complevel': complevel, 'shuffle': True,
+                            'chunksizes': chunk_shape}
+        if name == 'wse' and dtype == 'int16':
+            var_encoding.update({'dtype': 'int16', 'scale_factor': int16_scale, 'add_offset': int16_offset,
+                                 '_FillValue': int16_fill})
+        else:
+            var_encoding.update({'dtype': 'float32', '_FillValue': np.float32(np.nan)})
+        encoding[name] = var_encoding
+    return encoding
+
+
+def write_wse(ds, output_path, store='netcdf', compression='zlib', complevel=4, chunks=(256, 256), dtype='float32'):
+    """
+    Write the filtered dataset with the requested encoding and return the path written,
+    which ends in .zarr for the zarr store.
+    """
+    if dtype == 'int16' and 'wse' in ds and not fits_int16(ds['wse'].values):
+        logging.warning(f"wse of {os.path.basename(output_path)} is outside the int16 range. Writing float32.")
+        dtype = 'float32'
+
+    # The new encoding replaces the one inherited from the source granule, apart from the link to
+    # the CRS written by rioxarray; a fill value left in the attributes by reproject would clash with it
+    ds = ds.copy()
+    encoding = wse_encoding(ds, store, compression, complevel, chunks, dtype)
+    for name in ds.data_vars:
+        if 'grid_mapping' in ds[name].encoding:
+            encoding[name]['grid_mapping'] = ds[name].encoding['grid_mapping']
+        ds[name].attrs = {key: value for key, value in ds[name].attrs.items() if key != '_FillValue'}
+
+    path = store_path(output_path, store)
+    if store == 'zarr':
+        ds.to_zarr(path, mode='w', encoding=encoding)
+    else:
+        ds.to_netcdf(path, engine='netcdf4', encoding=encoding)
+    return path
+
+
+def open_wse(path, **kwargs):
+    """
+    Lazily open a filtered output, NetCDF or Zarr.
+    """
+    if path.rstrip('/').endswith('.zarr'):
+        return xr.open_dataset(path, engine='zarr', **kwargs)
+    return xr.open_dataset(path, **kwargs)
+
+
+def path_size(path):
+    """
+    Size in bytes of a file, or of all files below a directory (a Zarr store).
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, dirs, files in os.walk(path) for file in files)
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, ALL_COMPLETED, wait
+import matplotlib
+
+
+def init_worker():
+    """
+    Each worker process draws off-screen with its own matplotlib backend.
+    """
+    matplotlib.use('Agg')
+
+
+def error_message(error):
+    return f"{type(error).__name__}: {error}"
+
+
+def run_tasks(render, tasks, jobs=1, max_pending=None):
+    """
+    Call render(*args) for every (key, args) in tasks, in this process when jobs is 1 and on a pool
+    of `jobs` worker processes otherwise. tasks may be a generator: at most max_pending tasks
+    (default 2 x jobs) are in flight, so their arguments don't pile up in memory.
+    A failing task does not stop the others; returns {key: error message} of the failed tasks.
+    """
+    failures = {}
+    if jobs <= 1:
+        for key, args in tasks:
+            try:
+                render(*args)
+            except Exception as e:
+                failures[key] = error_message(e)
+        return failures
+
+    max_pending = max_pending or 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker) as executor:
+        pending = {}
+
+        def collect(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                key = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    failures[key] = error_message(error)
+
+        for key, args in tasks:
+            if len(pending) >= max_pending:
+                collect(FIRST_COMPLETED)
+            pending[executor.submit(render, *args)] = key
+        if pending:
+            collect(ALL_COMPLETED)
+    return failures
+
+
+def report_failures(failures, what='dates'):
+    """
+    Print the tasks that failed and why.
+    """
+    if not failures:
+        return
+    print(f"Failed to render {len(failures)} {what}:")
+    for key in sorted(failures):
+        print(f"  {key}: {failures[key]}")
@@ -0,0 +1,174 @@
+import numpy as np
+import logging
+
+
+def exact_quantiles(values, low=0.05, high=0.95):
+    """
+    Return the low and high quantiles of the non-NaN values with a single partition pass.
+    Uses the same linear interpolation as xarray's DataArray.quantile, so the cut points match it.
+    """
+    values = np.asarray(values).ravel()
+    valid = values[~np.isnan(values)]
+    if valid.size == 0:
+        return np.float32(np.nan), np.float32(np.nan)
+    # np.quantile partitions once around every index both cut points need, no full sort
+    quantile_low, quantile_high = np.quantile(valid, np.array([low, high], dtype=np.float64), overwrite_input=True)
+    return np.float32(quantile_low), np.float32(quantile_high)
+
+
+def iter_blocks(data, block_rows=512):
+    """
+    Yield row blocks of a 2-D array-like. Lazily loaded xarray or dask data is only read block by block.
+    """
+    n_rows = data.shape[0]
+    for start in range(0, n_rows, block_rows):
+        yield np.asarray(data[start:start + block_rows], dtype=np.float64)
+
+
+def histogram_quantiles(blocks, low=0.05, high=0.95, bins=65536):
+    """
+    Approximate the low and high quantiles of chunked data from one histogram.
+    `blocks` is a callable returning a fresh iterator of arrays; it is walked twice, once for the
+    value range and once for the counts, so only one block is held in memory at a time.
+    The error of each cut point is at most one bin width, (max - min) / bins.
+    """
+    data_min = np.inf
+    data_max = -np.inf
+    for block in blocks():
+        valid = block[~np.isnan(block)]
+        if valid.size:
+            data_min = min(data_min, valid.min())
+            data_max = max(data_max, valid.max())
+    if not np.isfinite(data_min):
+        return np.float32(np.nan), np.float32(np.nan)
+    if data_min == data_max:
+        return np.float32(data_min), np.float32(data_max)
+
+    counts = np.zeros(bins, dtype=np.int64)
+    for block in blocks():
+        valid = block[~np.isnan(block)]
+        counts += np.histogram(valid, bins=bins, range=(data_min, data_max))[0]
+
+    edges = np.linspace(data_min, data_max, bins + 1)
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+
+    def order_statistic(k):
+        # The k-th smallest value lies in the first bin whose cumulative count exceeds k
+        i = int(np.searchsorted(cumulative, k, side='right'))
+        below = cumulative[i - 1] if i > 0 else 0
+        return edges[i] + (k - below + 0.5) / counts[i] * (edges[i + 1] - edges[i])
+
+    cut_points = []
+    for q in (low, high):
+        # Interpolate between the neighbouring order statistics as the exact linear method does
+        virtual_index = (total - 1) * q
+        previous_index = int(np.floor(virtual_index))
+        next_index = min(previous_index + 1, total - 1)
+        gamma = virtual_index - previous_index
+        previous_value = order_statistic(previous_index)
+        next_value = order_statistic(next_index)
+        cut_points.append(np.float32(previous_value + gamma * (next_value - previous_value)))
+    return cut_points[0], cut_points[1]
+
+
+def quantile_cut_points(data, low=0.05, high=0.95, method='exact', bins=65536, block_rows=512):
+    """
+    Return the low and high quantiles of a raster with the 'exact' or 'histogram' method.
+    """
+    if method == 'exact':
+        return exact_quantiles(np.asarray(data), low, high)
+    elif method == 'histogram':
+        return histogram_quantiles(lambda: iter_blocks(data, block_rows), low, high, bins)
+    raise ValueError(f"Unknown quantile method: {method}")
+
+
+def quantile_drop_indexers(values, dims, quantile_low, quantile_high):
+    """
+    Indexers of the rows and columns that ds.where(wse >= quantile_low, drop=True)
+    .where(wse <= quantile_high, drop=True) keeps. As in that chain, the second condition is taken
+    on the unmasked values over the rows and columns the first one kept, so a row whose only values
+    lie one below quantile_low and one above quantile_high survives as an empty row.
+    """
+    indexers = {dim: np.arange(size) for dim, size in zip(dims, values.shape)}
+    # NaN compares False, so missing pixels count as dropped
+    for condition in (values >= quantile_low, values <= quantile_high):
+        condition = condition[np.ix_(*indexers.values())]
+        for axis, dim in enumerate(dims):
+            other_axes = tuple(a for a in range(condition.ndim) if a != axis)
+            indexers[dim] = indexers[dim][condition.any(axis=other_axes)]
+    return indexers
+
+
+def apply_quantile_filter(ds, quantile_low, quantile_high, variable='wse', drop=True):
+    """
+    Mask values of `variable` outside [quantile_low, quantile_high] in place.
+    Float variables on the same grid are masked with it. With drop=True, the rows and columns that
+    ds.where(wse >= low, drop=True).where(wse <= high, drop=True) drops are removed as well, using one
+    isel instead of rebuilding the dataset twice.
+    """
+    values = ds[variable].values
+    dims = ds[variable].dims
+    if drop:
+        # Worked out before masking, since the chain takes its second condition on the unmasked values
+        indexers = quantile_drop_indexers(values, dims, quantile_low, quantile_high)
+    keep = (values >= quantile_low) & (values <= quantile_high)
+
+    for name, var in ds.data_vars.items():
+        if var.dims == dims and np.issubdtype(var.dtype, np.floating):
+            data = var.values
+            data[~keep] = np.nan
+            ds[name].values = data
+
+    if drop:
+        ds = ds.isel(indexers)
+
+    logging.info(f"Kept {int(keep.sum())} of {keep.size} {variable} pixels between {quantile_low} and {quantile_high}.")
+    return ds
+
+
+def drop_empty(ds, variable='wse', keep=None):
+    """
+    Remove the rows and columns of ds with no value of `variable` (or no True in `keep`), the way
+    ds.where(..., drop=True) does.
+    """
+    if keep is None:
+        keep = ~np.isnan(ds[variable].values)
+    indexers = {}
+    for axis, dim in enumerate(ds[variable].dims):
+        other_axes = tuple(a for a in range(keep.ndim) if a != axis)
+        indexers[dim] = np.flatnonzero(keep.any(axis=other_axes))
+    return ds.isel(indexers)
+
+
+if __name__ == "__main__":
+    # Check the filter against the xarray quantile/where(drop=True) chain on synthetic rasters
+    import xarray as xr
+
+    rng = np.random.default_rng(0)
+    for shape in [(200, 300), (1000, 800), (37, 1), (50, 40)]:
+        wse = rng.normal(20, 15, shape).astype('float32')
+        wse[rng.random(shape) < 0.6] = np.nan
+        wse[:3] = np.nan
+        if shape == (50, 40):
+            # A row and a column whose only values lie one below the low and one above the high
+            # cut point: the xarray chain keeps them, empty
+            wse[10] = np.nan
+            wse[:, 7] = np.nan
+            wse[10, 0], wse[10, 1] = -1000, 1000
+            wse[20, 7], wse[21, 7] = -1000, 1000
+        ds = xr.Dataset({'wse': (('y', 'x'), wse)},
+                        coords={'y': np.arange(shape[0])[::-1] * 100.0, 'x': np.arange(shape[1]) * 100.0})
+
+        expected_low = np.float32(ds['wse'].quantile(0.05).item())
+        expected_high = np.float32(ds['wse'].quantile(0.95).item())
+        expected = ds.where(ds['wse'] >= expected_low, drop=True).where(ds['wse'] <= expected_high, drop=True)
+
+        quantile_low, quantile_high = quantile_cut_points(ds['wse'])
+        filtered = apply_quantile_filter(ds.copy(deep=True), quantile_low, quantile_high)
+        assert (quantile_low, quantile_high) == (expected_low, expected_high)
+        xr.testing.assert_identical(filtered, expected)
+
+        approx_low, approx_high = quantile_cut_points(ds['wse'], method='histogram', block_rows=64)
+        print(f"{shape}: exact match; histogram error {abs(approx_low - quantile_low):.2e}, "
+              f"{abs(approx_high - quantile_high):.2e}")
@@ -0,0 +1,134 @@
+"""
+Registry of the regions the pipeline serves, and a spatial index that maps granules to them.
+
+A registry is a JSON file listing the regions, each with a polygon layer, the CRS its outputs
+are written in and the folder they go to (relative paths are taken from the registry's folder):
+
+    {"regions": [
+        {"name": "east-bengal", "geojson": "east-bengal.geojson", "crs": "EPSG:32645",
+         "output_dir": "../Filtered_Data/"},
+        {"name": "tripura", "geojson": "tripura.geojson", "crs": "EPSG:32646",
+         "output_dir": "../Regions/Tripura/Filtered_Data/"}
+    ]}
+
+The lon/lat outlines of the regions go into a shapely STRtree, so the regions a granule touches
+are found from its UMM footprint polygon before it is downloaded. The same footprints give the
+fraction of each granule that overlaps an AOI, which the download prefilter uses.
+"""
+import os
+import json
+import geopandas as gpd
+from shapely import STRtree
+from shapely.geometry import Polygon, MultiPolygon, box
+from shapely.ops import unary_union
+
+# Equal-area projection the footprint overlaps are measured in
+equal_area_crs = "EPSG:6933"
+
+
+class Region:
+    def __init__(self, name, geojson, crs, output_dir):
+        self.name = name
+        self.geojson = geojson
+        self.crs = crs
+        self.output_dir = output_dir
+        self.polygons = gpd.read_file(geojson).to_crs(crs)
+        # Lon/lat outline for the spatial index and the footprint tests
+        self.outline = unary_union(self.polygons.to_crs("EPSG:4326").geometry)
+
+    def output_path(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def __repr__(self):
+        return f"Region({self.name!r}, {self.crs})"
+
+
+class RegionRegistry:
+    def __init__(self, regions):
+        self.regions = list(regions)
+        self.tree = STRtree([region.outline for region in self.regions])
+
+    @classmethod
+    def load(cls, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            entries = json.load(f)['regions']
+        return cls(Region(entry['name'], os.path.join(folder, entry['geojson']), entry.get('crs', "EPSG:32645"),
+                          os.path.join(folder, entry['output_dir'])) for entry in entries)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def bounding_box(self):
+        """
+        (west, south, east, north) around all regions, for earthaccess.search_data.
+        """
+        return tuple(float(v) for v in unary_union([region.outline for region in self.regions]).bounds)
+
+    def regions_for(self, geometry):
+        """
+        Regions whose polygons intersect a lon/lat geometry, in registry order.
+        """
+        hits = self.tree.query(geometry, predicate='intersects')
+        return [self.regions[i] for i in sorted(hits)]
+
+    def aoi(self, regions=None):
+        """
+        Union of the polygons of the given regions (default: all) as a lon/lat GeoDataFrame.
+        """
+        outlines = [region.outline for region in (self.regions if regions is None else regions)]
+        return gpd.GeoDataFrame(geometry=[unary_union(outlines)], crs="EPSG:4326")
+
+
+def granule_footprint(granule):
+    """
+    Lon/lat footprint of a granule from the GPolygons of its UMM metadata, or None if it has none.
+    Falls back to the bounding rectangles when there are no polygons.
+    """
+    geometry = granule['umm'].get('SpatialExtent', {}).get('HorizontalSpatialDomain', {}).get('Geometry', {})
+    polygons = []
+    for polygon in geometry.get('GPolygons', []):
+        points = polygon['Boundary']['Points']
+        polygons.append(Polygon([(point['Longitude'], point['Latitude']) for point in points]))
+    if not polygons:
+        polygons = [box(rect['WestBoundingCoordinate'], rect['SouthBoundingCoordinate'],
+                        rect['EastBoundingCoordinate'], rect['NorthBoundingCoordinate'])
+                    for rect in geometry.get('BoundingRectangles', [])]
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+
+def granule_size(granule):
+    """
+    Size of a granule's files in bytes from its UMM metadata, or 0 if it is not given.
+    """
+    units = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+    size = 0
+    for item in granule['umm'].get('DataGranule', {}).get('ArchiveAndDistributionInformation', []):
+        if 'SizeInBytes' in item:
+            size += item['SizeInBytes']
+        elif 'Size' in item:
+            size += item['Size'] * units.get(item.get('SizeUnit', 'MB'), 1024 ** 2)
+    return int(size)
+
+
+def footprint_overlaps(granules, aoi):
+    """
+    Fraction of each granule's UMM footprint that lies inside the AOI (a GeoDataFrame), measured
+    in an equal-area projection; None for granules without a footprint.
+    """
+    footprints = [granule_footprint(granule) for granule in granules]
+    known = [i for i, footprint in enumerate(footprints) if footprint is not None]
+    overlaps = [None] * len(granules)
+    if not known:
+        return overlaps
+    areas = gpd.GeoSeries([footprints[i] for i in known], crs="EPSG:4326").to_crs(equal_area_crs)
+    region = unary_union(aoi.to_crs(equal_area_crs).geometry)
+    fractions = (areas.intersection(region).area / areas.area).fillna(0.0)
+    for i, fraction in zip(known, fractions):
+        overlaps[i] = float(fraction)
+    return overlaps
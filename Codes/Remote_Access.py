@@ -0,0 +1,149 @@
+"""
+Open SWOT granules over HTTPS with byte-range requests instead of downloading them.
+
+The remote file is read through fsspec with a block cache, so only the blocks that hold the
+NetCDF/HDF5 metadata and the chunks of the variables and window actually selected are fetched.
+Servers that cannot serve ranges (unknown size, or a full response to a range request) raise
+RangeReadsUnsupported, so the caller can fall back to downloading the whole granule.
+Reading the HDF5 files from a file object needs h5netcdf and h5py.
+"""
+import os
+
+# 4 MB blocks, at most 64 of them (256 MB) kept per open file
+block_size = 4 * 1024 ** 2
+max_blocks = 64
+
+# Authenticated HTTPS filesystem of this process, created on first use. fsspec's async
+# filesystems are not fork-safe, so a worker process makes its own.
+_filesystem = None
+_filesystem_pid = None
+
+
+class RangeReadsUnsupported(OSError):
+    pass
+
+
+def https_filesystem():
+    """
+    fsspec HTTPS filesystem carrying the Earthdata login of earthaccess.
+    """
+    global _filesystem, _filesystem_pid
+    if _filesystem is None or _filesystem_pid != os.getpid():
+        import earthaccess
+        _filesystem = earthaccess.get_fsspec_https_session()
+        _filesystem_pid = os.getpid()
+    return _filesystem
+
+
+def open_remote(url, fs=None, block_size=block_size, max_blocks=max_blocks):
+    """
+    Open a remote file for random access through a block cache.
+    Raises RangeReadsUnsupported if the server cannot answer byte-range requests.
+    """
+    fs = fs or https_filesystem()
+    f = fs.open(url, mode='rb', block_size=block_size, cache_type='blockcache',
+                cache_options={'maxblocks': max_blocks})
+    if getattr(f, 'size', None) is None:
+        f.close()
+        raise RangeReadsUnsupported(f"The size of {url} is unknown")
+
+    # fsspec accepts a full response for a range at the start of the file, so probe the last byte.
+    # The file's own range fetch raises on a full response as soon as the headers arrive and drops
+    # the connection, so a server that ignores ranges does not send the whole granule here.
+    try:
+        tail = f._fetch_range(f.size - 1, f.size) if f.size else b''
+    except ValueError:
+        f.close()
+        raise RangeReadsUnsupported(f"The server of {url} ignores range requests")
+    if len(tail) != min(f.size, 1):
+        f.close()
+        raise RangeReadsUnsupported(f"The server of {url} ignores range requests")
+    return f
+
+
+def fetched_bytes(f):
+    """
+    Bytes requested from the server through the block cache of an open remote file.
+    """
+    return min(getattr(getattr(f, 'cache', None), 'total_requested_bytes', 0), f.size or 0)
+
+
+if __name__ == "__main__":
+    # Check range reads and the fallback against local HTTP servers with and without range support
+    import re
+    import shutil
+    import tempfile
+    import threading
+    import functools
+    import http.server
+    import fsspec
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        """
+        Static file server that answers single byte ranges if `ranges` is set and counts the bytes it sends.
+        """
+        ranges = True
+        sent = [0]
+
+        def send_head(self):
+            path = self.translate_path(self.path)
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if not (self.ranges and match and os.path.isfile(path)):
+                self.remaining = None
+                return super().send_head()
+            size = os.path.getsize(path)
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            f = open(path, 'rb')
+            f.seek(start)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.remaining = end - start + 1
+            return f
+
+        def copyfile(self, source, outputfile):
+            remaining = self.remaining
+            try:
+                while remaining is None or remaining > 0:
+                    chunk = source.read(64 * 1024 if remaining is None else min(64 * 1024, remaining))
+                    if not chunk:
+                        break
+                    outputfile.write(chunk)
+                    self.sent[0] += len(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    folder = tempfile.mkdtemp(prefix='remote_access_')
+    data = os.urandom(32 * 1024 ** 2)
+    with open(os.path.join(folder, 'granule.nc'), 'wb') as f:
+        f.write(data)
+    try:
+        for ranges in (True, False):
+            handler = type('Handler', (Handler,), {'ranges': ranges, 'sent': [0]})
+            server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=folder))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_port}/granule.nc'
+            fs = fsspec.filesystem('http', skip_instance_cache=True)
+            try:
+                with open_remote(url, fs, block_size=1024 ** 2) as f:
+                    f.seek(len(data) // 2)
+                    assert f.read(1000) == data[len(data) // 2:len(data) // 2 + 1000]
+                    fetched = fetched_bytes(f)
+                assert ranges and fetched < len(data)
+                print(f"Range server: read 1000 bytes, fetched {fetched} of {len(data)} bytes")
+            except RangeReadsUnsupported as e:
+                sent = handler.sent[0]
+                assert not ranges and sent < len(data) / 2, sent
+                print(f"Server without ranges: {e}; the probe transferred {sent} of {len(data)} bytes")
+            finally:
+                server.shutdown()
+                server.server_close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,163 @@
+"""
+Cached nearest-neighbour reprojection for granules on fixed grids (UTM44/UTM46 -> UTM45).
+
+SWOT raster tiles of a pass/scene always sit on the same grid, so the mapping from output to
+input pixels only has to be worked out once per source grid (CRS, transform, shape) and target
+CRS. It is built by warping a raster of source pixel numbers with the same rasterio/GDAL call
+rio.reproject makes, which gives exactly the pixels rio.reproject's nearest resampling picks.
+The gather index and target grid are stored in a .npz file. Later granules on the same grid are
+warped with one NumPy indexing step per variable. The least recently used files are evicted
+once the cache grows past max_bytes.
+"""
+import os
+import hashlib
+import numpy as np
+import xarray as xr
+import rioxarray  # registers the .rio accessor
+from affine import Affine
+from rasterio.warp import reproject, calculate_default_transform, Resampling
+
+cache_dir = '../Reprojection_Cache/'
+# Attributes rio.reproject leaves out of its outputs
+dropped_attrs = ('_FillValue', 'missing_value', 'fill_value', 'nodata', 'nodatavals', 'is_tiled', 'res')
+
+
+class ReprojectionCache:
+    def __init__(self, folder=cache_dir, max_bytes=1024 ** 3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def path(self, src_crs, src_transform, src_shape, dst_crs):
+        key = f"{src_crs}|{tuple(src_transform)[:6]}|{tuple(src_shape)}|{dst_crs}"
+        return os.path.join(self.folder, f"warp_{hashlib.sha256(key.encode()).hexdigest()[:20]}.npz")
+
+    def gather_index(self, src_crs, src_transform, src_shape, dst_crs):
+        """
+        Flat source pixel of every target pixel (src_shape[0] * src_shape[1] where there is none),
+        with the target transform, for a source grid and target CRS. Built and stored on a miss.
+        """
+        path = self.path(src_crs, src_transform, src_shape, dst_crs)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as cache:
+                    index, dst_transform = cache['index'], Affine(*cache['transform'])
+                os.utime(path)  # Mark as recently used for the eviction
+                return index, dst_transform
+            except (OSError, ValueError, KeyError):
+                pass  # Unreadable (e.g. truncated) entries are rebuilt
+
+        index, dst_transform = build_gather_index(src_crs, src_transform, src_shape, dst_crs)
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, index=index, transform=np.array(tuple(dst_transform)[:6]))
+        os.replace(tmp_path, path)
+        self.evict()
+        return index, dst_transform
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for file in os.listdir(self.folder):
+            if file.startswith('warp_') and file.endswith('.npz') and '.tmp' not in file:
+                try:
+                    stat = os.stat(os.path.join(self.folder, file))
+                except FileNotFoundError:
+                    continue  # Evicted by another worker in the meantime
+                entries.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, file))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def reproject(self, ds, dst_crs):
+        """
+        Same result as ds.rio.reproject(dst_crs) (nearest resampling) for a Dataset or DataArray whose
+        gridded variables are float on (y, x). Variables without x/y are copied as rio.reproject does.
+        Falls back to rio.reproject for anything else.
+        """
+        variables = ds.data_vars.values() if isinstance(ds, xr.Dataset) else [ds]
+        gridded = [var for var in variables if 'x' in var.dims or 'y' in var.dims or var.ndim >= 2]
+        if not gridded or any(var.dims != ('y', 'x') or not np.issubdtype(var.dtype, np.floating)
+                              or (var.rio.nodata is not None and not np.isnan(var.rio.nodata))
+                              for var in gridded):
+            return ds.rio.reproject(dst_crs)
+
+        src_shape = (ds.sizes['y'], ds.sizes['x'])
+        index, dst_transform = self.gather_index(ds.rio.crs.to_string(), ds.rio.transform(), src_shape, dst_crs)
+        height, width = index.shape
+        # Pixel centres computed as rioxarray does, so the coordinates match to the last bit
+        centres = dst_transform * Affine.translation(0.5, 0.5)
+        x, _ = centres * (np.arange(width), np.zeros(width))
+        _, y = centres * (np.zeros(height), np.arange(height))
+
+        def warp(var):
+            if var.dims != ('y', 'x'):
+                return var.copy()
+            # The extra NaN at the end is picked for target pixels without a source pixel
+            values = np.append(var.values.ravel(), var.dtype.type(np.nan))
+            # Attributes as rio.reproject sets them: nodata attributes replaced by a NaN _FillValue
+            # unless the fill value is kept in the encoding
+            attrs = {key: value for key, value in var.attrs.items() if key not in dropped_attrs}
+            if var.rio.encoded_nodata is None:
+                attrs['_FillValue'] = np.nan
+            out = xr.DataArray(values[index], dims=('y', 'x'), coords={'x': x, 'y': y}, attrs=attrs, name=var.name)
+            out.encoding = var.encoding
+            return out
+
+        if isinstance(ds, xr.Dataset):
+            out = xr.Dataset({name: warp(var) for name, var in ds.data_vars.items()}, attrs=dict(ds.attrs))
+        else:
+            out = warp(ds)
+        return out.rio.write_crs(dst_crs).rio.write_transform(dst_transform).rio.write_coordinate_system()
+
+
+def build_gather_index(src_crs, src_transform, src_shape, dst_crs):
+    """
+    Warp a raster of source pixel numbers the way rio.reproject does (default target grid,
+    nearest resampling) to find the source pixel of every target pixel.
+    """
+    height, width = src_shape
+    left, top = src_transform * (0, 0)
+    right, bottom = src_transform * (width, height)
+    bounds = (min(left, right), min(top, bottom), max(left, right), max(top, bottom))
+    dst_transform, dst_width, dst_height = calculate_default_transform(src_crs, dst_crs, width, height, *bounds)
+
+    # Source pixel numbers, with -1 as nodata so GDAL masks and chunks the warp as for NaN data
+    pixels = np.arange(height * width, dtype=np.int64 if height * width >= 2 ** 31 else np.int32).reshape(src_shape)
+    index = np.full((dst_height, dst_width), -1, dtype=pixels.dtype)
+    reproject(pixels, index, src_transform=src_transform, src_crs=src_crs, src_nodata=-1,
+              dst_transform=dst_transform, dst_crs=dst_crs, dst_nodata=-1, resampling=Resampling.nearest)
+    index[index < 0] = height * width
+    return index, dst_transform
+
+
+if __name__ == "__main__":
+    # Check the cached warp against rio.reproject on synthetic granules with different gaps on the same grids
+    import time
+    import shutil
+    import tempfile
+    from Synthetic_SWOT import granule_dataset
+
+    cache = ReprojectionCache(tempfile.mkdtemp(prefix='reprojection_cache_'))
+    try:
+        for zone, center in [(46, (92.3, 23.5)), (44, (88.0, 23.0))]:
+            for seed in range(3):
+                ds = granule_dataset(zone, center, 1000, seed).astype('float32').rio.write_crs(f"EPSG:326{zone}")
+                start = time.perf_counter()
+                expected = ds.rio.reproject("EPSG:32645")
+                rio_time = time.perf_counter() - start
+                start = time.perf_counter()
+                warped = cache.reproject(ds, "EPSG:32645")
+                cache_time = time.perf_counter() - start
+                xr.testing.assert_identical(warped, expected)
+                print(f"UTM{zone} granule {seed}: identical; rio.reproject {rio_time:.3f} s, cache {cache_time:.3f} s")
+        print(f"{len(os.listdir(cache.folder))} cache entries for 2 grids")
+    finally:
+        shutil.rmtree(cache.folder, ignore_errors=True)
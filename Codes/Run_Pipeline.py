@@ -0,0 +1,220 @@
+"""
+Run the whole pipeline in one Python process: download and filter, single-date images, mosaics
+and the available-dates calendar.
+
+The stages form a small chain, each with an input fingerprint (the files and options it depends
+on) and an output manifest (name, size and modification time of the files it produced), kept in
+a state file. A stage is skipped if it finished before with the same input fingerprint and its
+outputs are unchanged on disk, so a run after a failure resumes at the stage that failed. The
+download stage depends on the search period, so it runs once per day; the render stages depend
+on the filtered files, and the calendar is updated with the dates of the new images only.
+Dates and mosaics that fail to render are listed under 'failures' in the stage record without
+failing the stage; they are rendered again the next time the stage runs.
+
+    python Run_Pipeline.py --workers 4 --render-mode raster --jobs 4
+"""
+import os
+import json
+import hashlib
+import argparse
+import traceback
+from datetime import datetime
+import Download_SWOT_Data
+import Create_SWOT_Image
+import Create_SWOT_Mosaicked_Image
+import Calendar_Dates
+from Instrumentation import span, enable, summary
+
+state_path = '../pipeline_state.json'
+
+
+def manifest(folder):
+    """
+    Name -> [size, mtime_ns] of the entries of a folder (empty if it does not exist).
+    """
+    if not os.path.isdir(folder):
+        return {}
+    entries = {}
+    with os.scandir(folder) as scan:
+        for entry in scan:
+            stat = entry.stat()
+            entries[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return entries
+
+
+def fingerprint(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path):
+    """
+    Write the state atomically so an interrupted run never leaves a half-written file.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class Stage:
+    """
+    A pipeline stage: run(state) does the work and may return extra fields for its state record,
+    inputs(state) returns what its fingerprint is taken over, and outputs are the folders it writes.
+    """
+
+    def __init__(self, name, run, inputs, outputs):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def output_manifest(self):
+        return {folder: manifest(folder) for folder in self.outputs}
+
+
+def is_up_to_date(stage, record, inputs):
+    return (record.get('status') == 'done' and record.get('inputs') == inputs
+            and record.get('outputs') == stage.output_manifest())
+
+
+def run_pipeline(stages, path=state_path, force=()):
+    """
+    Run the stages in order, skipping the ones that are up to date, and stop at the first failure.
+    Returns True if every stage finished.
+    """
+    state = load_state(path)
+    for stage in stages:
+        record = state['stages'].get(stage.name, {})
+        inputs = fingerprint(stage.inputs(state))
+        if stage.name not in force and is_up_to_date(stage, record, inputs):
+            print(f"{stage.name}: up to date")
+            continue
+
+        print(f"{stage.name}: running")
+        started = datetime.now().isoformat(timespec='seconds')
+        try:
+            with span('stage', stage=stage.name):
+                extra = stage.run(state) or {}
+        except Exception as e:
+            traceback.print_exc()
+            state['stages'][stage.name] = {'status': 'failed', 'inputs': inputs, 'started': started,
+                                           'error': f"{type(e).__name__}: {e}"}
+            save_state(state, path)
+            print(f"{stage.name}: failed, the next run resumes here")
+            return False
+
+        state['stages'][stage.name] = {'status': 'done', 'inputs': inputs, 'outputs': stage.output_manifest(),
+                                       'started': started, 'finished': datetime.now().isoformat(timespec='seconds'),
+                                       **extra}
+        save_state(state, path)
+        if extra.get('failures'):
+            print(f"{stage.name}: {len(extra['failures'])} failed to render, listed under 'failures' in {path}")
+    return True
+
+
+def stage_outputs(state, name, folder):
+    return state['stages'].get(name, {}).get('outputs', {}).get(folder, {})
+
+
+def pipeline_stages(args):
+    """
+    The download, images, mosaics and calendar stages configured from the command line options.
+    """
+    netcdf_dir = Create_SWOT_Image.netcdf_dir
+    download_args = ['--workers', str(args.workers), '--mode', args.mode, '--ingest', args.ingest,
+                     '--min-overlap', str(args.min_overlap)] + \
+        (['--regions', args.regions] if args.regions else [])
+    image_args = ['--render-mode', args.render_mode, '--dpi', str(args.dpi), '--jobs', str(args.jobs)] + \
+        (['--no-basemap'] if args.no_basemap else []) + (['--offline'] if args.offline else [])
+    mosaic_options = dict(days=args.days, method=args.method, render_mode=args.render_mode, dpi=args.dpi,
+                          jobs=args.jobs, basemap=not args.no_basemap, offline=args.offline)
+
+    def download(state):
+        status = Download_SWOT_Data.main(download_args)
+        if status != 'finished':
+            raise RuntimeError(f"Download_SWOT_Data.py {status} (see its log)")
+
+    def images(state):
+        return {'failures': {str(date): error for date, error in Create_SWOT_Image.main(image_args).items()}}
+
+    def mosaics(state):
+        failures = Create_SWOT_Mosaicked_Image.process_all_files(**mosaic_options)
+        return {'failures': {str(date): error for date, error in failures.items()}}
+
+    # Image folder of each calendar subfolder, and the stage that writes it
+    calendar_sources = {'single_images': ('images', Create_SWOT_Image.output_dir),
+                        'mosaic_images': ('mosaics', Create_SWOT_Mosaicked_Image.output_dir)}
+
+    def calendar_inputs(state):
+        return {subfolder: sorted(stage_outputs(state, name, folder))
+                for subfolder, (name, folder) in calendar_sources.items()}
+
+    def calendar(state):
+        # The image stages recorded their outputs, so only the images added since the last update
+        # are read; the dates are rebuilt from the full list if images were removed.
+        seen = state['stages'].get('calendar', {}).get('seen', {})
+        current = calendar_inputs(state)
+        for subfolder, files in current.items():
+            previous = set(seen.get(subfolder, []))
+            if subfolder not in seen or not previous <= set(files):
+                Calendar_Dates.write_dates(subfolder, Calendar_Dates.image_dates(subfolder, files))
+            else:
+                Calendar_Dates.add_dates(subfolder, set(files) - previous)
+        return {'seen': current}
+
+    return [
+        Stage('download', download, lambda state: {'period': datetime.today().strftime('%Y-%m-%d'),
+                                                   'args': download_args},
+              [netcdf_dir]),
+        Stage('images', images, lambda state: {'files': manifest(netcdf_dir), 'args': image_args},
+              [Create_SWOT_Image.output_dir]),
+        Stage('mosaics', mosaics, lambda state: {'files': manifest(netcdf_dir), 'options': mosaic_options},
+              [Create_SWOT_Mosaicked_Image.output_dir]),
+        Stage('calendar', calendar, calendar_inputs,
+              [os.path.join(Calendar_Dates.output_folder, subfolder) for subfolder in calendar_sources]),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1, help="Download/process workers of the download stage.")
+    parser.add_argument('--mode', choices=['full', 'windowed'], default='full', help="Filter mode of the download stage.")
+    parser.add_argument('--ingest', choices=['download', 'stream'], default='download',
+                        help="'stream' reads the AOI window of each granule with range requests (needs --mode windowed).")
+    parser.add_argument('--regions', default=None, metavar='REGISTRY',
+                        help="Region registry of the download stage; the images are made for Filtered_Data.")
+    parser.add_argument('--min-overlap', type=float, default=0.0,
+                        help="Minimum fraction of a granule's footprint inside the AOI for it to be downloaded.")
+    parser.add_argument('--render-mode', choices=['pcolormesh', 'raster'], default='pcolormesh',
+                        help="Render mode of the images and mosaics.")
+    parser.add_argument('--dpi', type=int, default=1200, help="Output resolution of the JPEG images.")
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes rendering dates in parallel.")
+    parser.add_argument('--days', type=int, default=10, help="Window length of the mosaics in days.")
+    parser.add_argument('--method', choices=['latest', 'mean', 'median'], default='latest',
+                        help="How overlapping granules are combined in the mosaics.")
+    parser.add_argument('--no-basemap', action='store_true', help="Leave out the OSM basemap, coastlines and borders.")
+    parser.add_argument('--offline', action='store_true',
+                        help="Render without downloading basemap tiles; tiles missing from the cache are drawn blank.")
+    parser.add_argument('--force', nargs='+', default=[], choices=['download', 'images', 'mosaics', 'calendar'],
+                        help="Run these stages even if they are up to date.")
+    parser.add_argument('--state', default=state_path, help="State file with the fingerprints of the last run.")
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help="Append timing, memory and I/O spans to FILE as JSON lines (same as SWOT_TRACE=FILE).")
+    args = parser.parse_args(argv)
+
+    print_summary = enable(args.trace)
+    finished = run_pipeline(pipeline_stages(args), args.state, force=set(args.force))
+    if print_summary:
+        summary()
+    return finished
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
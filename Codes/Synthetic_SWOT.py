@@ -0,0 +1,187 @@
+"""
+Synthetic SWOT_L2_HR_Raster_100m granules for offline tests and benchmarks.
+
+Granules get realistic native-ids (UTM44/45/46 zones, cycle/pass/tile, start and end times),
+UMM metadata with a footprint polygon, file size and data link, like the results of earthaccess.search_data.
+Their rasters are 100 m grids in the granule's UTM zone placed over the AOI, with wse over two
+swaths separated by the nadir gap, NaN gaps and a few outliers for the quantile filter to trim.
+Filtered-looking UTM45 files can be written directly for the rendering benchmarks.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import xarray as xr
+import rioxarray  # registers the .rio accessor
+from datetime import datetime, timedelta
+from pyproj import Transformer
+
+zone_crs = {44: "EPSG:32644", 45: "EPSG:32645", 46: "EPSG:32646"}
+archive_url = 'https://archive.swot.podaac.earthdata.nasa.gov/podaac-swot-ops-cumulus-protected/SWOT_L2_HR_Raster_2.0'
+
+
+def granule_native_id(zone, start, cycle=1, pass_number=1, tile=1, band='Q'):
+    """
+    Native-id in the format of the SWOT 100 m raster product.
+    """
+    end = start + timedelta(seconds=21)
+    return (f"SWOT_L2_HR_Raster_100m_UTM{zone}{band}_N_x_x_x_{cycle:03d}_{pass_number:03d}_{tile:03d}F_"
+            f"{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}_PIC0_01")
+
+
+class SyntheticGranule(dict):
+    """
+    Stand-in for an earthaccess DataGranule: 'meta' and 'umm' entries and data_links().
+    """
+
+    @classmethod
+    def create(cls, zone, start, footprint, cycle=1, pass_number=1, tile=1):
+        native_id = granule_native_id(zone, start, cycle, pass_number, tile)
+        url = f"{archive_url}/{native_id}.nc"
+        points = [{'Longitude': lon, 'Latitude': lat} for lon, lat in footprint]
+        return cls({
+            'meta': {'native-id': native_id, 'concept-id': f"G-{native_id[-40:]}"},
+            'umm': {
+                'TemporalExtent': {'RangeDateTime': {
+                    'BeginningDateTime': f"{start:%Y-%m-%dT%H:%M:%S}Z",
+                    'EndingDateTime': f"{start + timedelta(seconds=21):%Y-%m-%dT%H:%M:%S}Z"}},
+                'RelatedUrls': [{'URL': url, 'Type': 'GET DATA'}],
+                'SpatialExtent': {'HorizontalSpatialDomain': {'Geometry': {
+                    'GPolygons': [{'Boundary': {'Points': points}}]}}},
+            },
+        })
+
+    def data_links(self, access=None):
+        return [item['URL'] for item in self['umm']['RelatedUrls']]
+
+
+def granule_dataset(zone, center, size=1400, seed=0):
+    """
+    Raster of one granule in its UTM zone, centred on the (lon, lat) `center`.
+    """
+    rng = np.random.default_rng(seed)
+    cx, cy = Transformer.from_crs("EPSG:4326", zone_crs[zone], always_xy=True).transform(*center)
+    x0 = np.floor(cx / 100) * 100 - 100 * (size // 2)
+    y0 = np.ceil(cy / 100) * 100 + 100 * (size // 2)
+    x = x0 + 50 + 100 * np.arange(size)
+    y = y0 - 50 - 100 * np.arange(size)
+
+    # Smooth floodplain rising to the north-east, with metre-scale noise
+    north = np.linspace(1, 0, size)[:, None]
+    east = np.linspace(0, 1, size)[None, :]
+    wse = (5 + 40 * north + 20 * east + rng.normal(0, 0.8, (size, size))).astype(np.float32)
+
+    # Two swaths with the nadir gap between them, random gaps and a few outliers
+    gap = size // 14
+    wse[:, size // 2 - gap // 2:size // 2 + gap // 2] = np.nan
+    wse[rng.random((size, size)) < 0.1] = np.nan
+    outliers = rng.random((size, size)) < 0.002
+    wse[outliers] = rng.choice([-1000.0, 9000.0], outliers.sum()).astype(np.float32)
+
+    uncert = np.where(np.isnan(wse), np.nan, rng.gamma(2.0, 0.05, (size, size))).astype(np.float32)
+    qual = np.where(np.isnan(wse), 3, rng.integers(0, 2, (size, size))).astype(np.int8)
+    return xr.Dataset({'wse': (('y', 'x'), wse), 'wse_uncert': (('y', 'x'), uncert), 'wse_qual': (('y', 'x'), qual)},
+                      coords={'x': x, 'y': y})
+
+
+def footprint(ds, zone):
+    """
+    Lon/lat corners of a granule raster, counter-clockwise and closed as in UMM GPolygons.
+    """
+    x0, x1 = float(ds['x'].min()) - 50, float(ds['x'].max()) + 50
+    y0, y1 = float(ds['y'].min()) - 50, float(ds['y'].max()) + 50
+    to_lonlat = Transformer.from_crs(zone_crs[zone], "EPSG:4326", always_xy=True)
+    corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+    return [tuple(round(v, 6) for v in to_lonlat.transform(x, y)) for x, y in corners]
+
+
+def write_archive(folder, n_granules, n_dates, start_date=datetime(2024, 1, 1), size=1400, seed=0,
+                  zones=(45, 46, 45, 44), extent=(89.9, 21.5, 92.8, 25.3)):
+    """
+    Write n_granules synthetic granules spread over n_dates into folder (the "remote" archive),
+    and return their SyntheticGranule metadata. The list is also saved as granules.json.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    granules = []
+    for i in range(n_granules):
+        zone = zones[i % len(zones)]
+        start = start_date + timedelta(days=i % n_dates, hours=int(rng.integers(0, 24)), minutes=int(rng.integers(0, 60)))
+        center = (rng.uniform(extent[0], extent[2]), rng.uniform(extent[1], extent[3]))
+        ds = granule_dataset(zone, center, size, seed=seed + i)
+        granule = SyntheticGranule.create(zone, start, footprint(ds, zone), cycle=1 + i // 100,
+                                          pass_number=i % 100, tile=i)
+        path = os.path.join(folder, f"{granule['meta']['native-id']}.nc")
+        ds.to_netcdf(path)
+        granule['umm']['DataGranule'] = {'ArchiveAndDistributionInformation': [
+            {'Name': os.path.basename(path), 'SizeInBytes': os.path.getsize(path)}]}
+        granules.append(granule)
+    with open(os.path.join(folder, 'granules.json'), 'w') as f:
+        json.dump(granules, f)
+    return granules
+
+
+def load_archive(folder):
+    with open(os.path.join(folder, 'granules.json')) as f:
+        return [SyntheticGranule(granule) for granule in json.load(f)]
+
+
+def archive_search(granules):
+    """
+    Stand-in for earthaccess.search_data that returns the given granules.
+    """
+    def search_data(**kwargs):
+        return list(granules)
+    return search_data
+
+
+class ArchiveDownload:
+    """
+    Stand-in for earthaccess.download that copies granules from a local archive folder.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def __call__(self, url, local_path):
+        os.makedirs(local_path, exist_ok=True)
+        file = url.rsplit('/', 1)[1]
+        shutil.copy(os.path.join(self.folder, file), os.path.join(local_path, file))
+        return [os.path.join(local_path, file)]
+
+
+def filtered_dataset(size, seed=0, water_fraction=0.08):
+    """
+    A clipped UTM45 wse raster: clustered water bodies with smooth elevations in a NaN background.
+    """
+    rng = np.random.default_rng(seed)
+    blocks = rng.random((size // 20 + 1, size // 20 + 1)) < water_fraction
+    water = np.kron(blocks, np.ones((20, 20), dtype=bool))[:size, :size]
+    water &= rng.random((size, size)) < 0.8
+    slope = np.linspace(2, 60, size, dtype=np.float32)
+    wse = slope[:, None] + rng.normal(0, 0.5, (size, size)).astype(np.float32)
+    wse[~water] = np.nan
+    x = 850050 + 100 * np.arange(size)
+    y = 2650050 - 100 * np.arange(size)
+    return xr.Dataset({'wse': (('y', 'x'), wse)}, coords={'x': x, 'y': y}).rio.write_crs("EPSG:32645")
+
+
+def write_filtered_files(folder, n_files, size, date='20240101', seed=0):
+    """
+    Write filtered-looking UTM45 wse files: patches of water in a NaN background inside the AOI.
+    """
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in range(n_files):
+        x0 = 850000 + 30000 * i
+        y0 = 2650000 - 40000 * i
+        x = x0 + 50 + 100 * np.arange(size)
+        y = y0 - 50 - 100 * np.arange(size)
+        wse = rng.gamma(2.0, 15.0, (size, size)).astype('float32')
+        wse[rng.random((size, size)) < 0.7] = np.nan
+        ds = xr.Dataset({'wse': (('y', 'x'), wse)}, coords={'x': x, 'y': y})
+        ds = ds.rio.write_crs("EPSG:32645")
+        file = f'SWOT_BD_{date}_{i:03d}_{i:03d}_wse.nc'
+        ds.to_netcdf(os.path.join(folder, file))
+        files.append(file)
+    return files
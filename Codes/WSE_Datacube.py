@@ -0,0 +1,192 @@
+"""
+Persistent (time, y, x) WSE datacube on the fixed 100 m UTM45 AOI grid, stored as Zarr.
+
+Every processed granule is resampled onto the grid (AOI_Grid.py) and appended as one time step.
+Only the chunks the granule covers are written, and the steps are keyed by the granule native-id,
+so appending a granule that is already in the cube does nothing. Time series of a pixel or a
+region only read the chunks they touch.
+
+    python WSE_Datacube.py --append ../Filtered_Data/*.nc
+    python WSE_Datacube.py --pixel 91.25 23.10
+    python WSE_Datacube.py --region 91.0 23.0 91.5 23.5
+"""
+import os
+import re
+import json
+import argparse
+import threading
+import numpy as np
+import xarray as xr
+import zarr
+from datetime import datetime
+from pyproj import Transformer
+from AOI_Grid import AOIGrid, nearest_index
+from Output_Format import open_wse
+from WSE_Stats_Index import sidecar_path
+
+datacube_path = '../WSE_Datacube.zarr'
+geojson_file = 'east-bengal.geojson'
+
+epoch = np.datetime64('1970-01-01T00:00:00', 's')
+
+
+def granule_time(native_id, output_path=None):
+    """
+    Start time of a granule from its native-id (..._20240201T120000_20240201T120021_...),
+    or the date in the filtered file name when the native-id has none.
+    """
+    match = re.search(r'_(\d{8}T\d{6})_', native_id or '')
+    if match:
+        return datetime.strptime(match.group(1), '%Y%m%dT%H%M%S')
+    return datetime.strptime(os.path.basename(output_path).split('_')[2], '%Y%m%d')
+
+
+class WSEDatacube:
+    """
+    Append-only WSE datacube. An existing store keeps its own grid; a new one is created on `grid`.
+    wse is chunked (time_chunk, chunk, chunk); granule native-ids are kept in the group attributes
+    in the order of the time steps and are written last, so a step interrupted by a crash is
+    reused by the next append.
+    """
+
+    def __init__(self, path=datacube_path, grid=None, time_chunk=16, chunk=256):
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            if grid is None:
+                raise ValueError(f"{path} does not exist and no grid was given to create it")
+            self.create(grid, time_chunk, chunk)
+        self.group = zarr.open_group(path, mode='r+')
+        self.grid = AOIGrid(self.group['x'][:], self.group['y'][:], self.group.attrs['crs'])
+
+    def create(self, grid, time_chunk, chunk):
+        ds = xr.Dataset({'wse': (('time', 'y', 'x'), np.empty((0,) + grid.shape, dtype=np.float32))},
+                        coords={'time': np.array([], dtype='datetime64[ns]'), 'y': grid.y, 'x': grid.x})
+        ds = ds.rio.write_crs(grid.crs)
+        ds.attrs.update({'crs': str(grid.crs), 'granules': []})
+        encoding = {
+            'wse': {'chunks': (time_chunk, chunk, chunk), 'dtype': 'float32', '_FillValue': np.float32(np.nan)},
+            'time': {'units': 'seconds since 1970-01-01', 'calendar': 'proleptic_gregorian', 'dtype': 'int64',
+                     'chunks': (4096,)},
+        }
+        ds.to_zarr(self.path, mode='w', encoding=encoding, consolidated=False)
+
+    @property
+    def granules(self):
+        return list(self.group.attrs['granules'])
+
+    def __contains__(self, native_id):
+        return native_id in self.granules
+
+    def __len__(self):
+        return len(self.granules)
+
+    def append(self, native_id, time, wse):
+        """
+        Add one granule as a time step. wse is a (y, x) DataArray in the grid's CRS.
+        Returns False if the granule is already in the cube.
+        """
+        flat_index, values = self.grid.resample(wse)
+        with self.lock:
+            granules = self.granules
+            if native_id in granules:
+                return False
+
+            wse_array = self.group['wse']
+            time_array = self.group['time']
+            step = len(granules)
+            if time_array.shape[0] > step:
+                # Left over from an interrupted append: clear it and reuse it
+                wse_array[step] = np.nan
+            else:
+                wse_array.resize((step + 1,) + wse_array.shape[1:])
+                time_array.resize((step + 1,))
+
+            if flat_index.size:
+                # Write only the bounding box of the granule on the grid
+                rows, cols = np.divmod(flat_index, self.grid.x.size)
+                row0, col0 = rows.min(), cols.min()
+                block = np.full((rows.max() - row0 + 1, cols.max() - col0 + 1), np.nan, dtype=np.float32)
+                block[rows - row0, cols - col0] = values
+                wse_array[step, row0:row0 + block.shape[0], col0:col0 + block.shape[1]] = block
+            time_array[step] = int((np.datetime64(time, 's') - epoch) / np.timedelta64(1, 's'))
+            self.group.attrs['granules'] = granules + [native_id]
+        return True
+
+    def append_file(self, output_path):
+        """
+        Append a filtered wse file; its native-id comes from the statistics sidecar.
+        """
+        native_id = None
+        try:
+            with open(sidecar_path(output_path)) as f:
+                native_id = json.load(f).get('native_id')
+        except (OSError, ValueError):
+            pass
+        if not native_id:
+            native_id = os.path.splitext(os.path.basename(output_path))[0]
+        with open_wse(output_path) as ds:
+            return self.append(native_id, granule_time(native_id, output_path), ds['wse'])
+
+    def open(self):
+        """
+        Lazily open the cube as a Dataset with the granule native-id of every time step.
+        """
+        ds = xr.open_dataset(self.path, engine='zarr', consolidated=False, decode_coords='all')
+        # Drop a step left by an interrupted append
+        ds = ds.isel(time=slice(0, len(self)))
+        return ds.assign_coords(granule=('time', self.granules))
+
+    def to_grid_crs(self, x, y, crs=None):
+        if crs is None:
+            return x, y
+        return Transformer.from_crs(crs, self.grid.crs, always_xy=True).transform(x, y)
+
+    def pixel_series(self, x, y, crs=None):
+        """
+        WSE time series of the grid pixel nearest to (x, y), given in `crs` (default: the grid's CRS).
+        """
+        x, y = self.to_grid_crs(x, y, crs)
+        col = nearest_index(self.grid.x, [x])[0]
+        row = nearest_index(self.grid.y, [y])[0]
+        if col < 0 or row < 0:
+            raise ValueError(f"({x}, {y}) is outside the datacube grid")
+        with self.open() as ds:
+            return ds['wse'].isel(y=row, x=col).load().sortby('time')
+
+    def region_series(self, bounds, crs=None):
+        """
+        Mean WSE and valid pixel count per time step over (minx, miny, maxx, maxy) given in `crs`.
+        """
+        minx, miny, maxx, maxy = bounds
+        if crs is not None:
+            minx, miny, maxx, maxy = Transformer.from_crs(crs, self.grid.crs, always_xy=True).transform_bounds(
+                minx, miny, maxx, maxy)
+        with self.open() as ds:
+            window = ds['wse'].sel(x=slice(minx, maxx), y=slice(maxy, miny)).load()
+        return xr.Dataset({'mean': window.mean(('y', 'x')), 'count': window.count(('y', 'x'))}).sortby('time')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=datacube_path, help="Zarr store of the datacube.")
+    parser.add_argument('--append', nargs='+', default=[], help="Filtered wse files to append.")
+    parser.add_argument('--pixel', nargs=2, type=float, metavar=('X', 'Y'), help="Print the series of a pixel.")
+    parser.add_argument('--region', nargs=4, type=float, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                        help="Print the mean series of a region.")
+    parser.add_argument('--crs', default='EPSG:4326', help="CRS of --pixel and --region.")
+    args = parser.parse_args()
+
+    grid = None if os.path.exists(args.path) else AOIGrid.from_geojson(geojson_file)
+    cube = WSEDatacube(args.path, grid)
+    for file in args.append:
+        try:
+            added = cube.append_file(file)
+            print(f"{'Added' if added else 'Already in the cube:'} {file}")
+        except Exception as e:
+            print(f"Error appending {file}: {e}")
+    if args.pixel:
+        print(cube.pixel_series(*args.pixel, crs=args.crs).to_series().dropna())
+    if args.region:
+        print(cube.region_series(args.region, crs=args.crs).to_dataframe()[['mean', 'count']])
+    print(f"{len(cube)} granules in {args.path}")
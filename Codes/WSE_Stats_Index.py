@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+from Output_Format import output_extensions, open_wse
+
+
+def sidecar_path(output_path):
+    """
+    Return the path of the statistics sidecar written next to a filtered wse file.
+    """
+    return f"{output_path}.json"
+
+
+def compute_stats(wse, output_path, native_id=None):
+    """
+    Summarise a filtered wse DataArray: min/max of the positive values, valid pixel count,
+    pixel-centre bounds, CRS, date and pass/tile id.
+    """
+    values = wse.values
+    positive = values[values >= 0]  # Only positive values, as the rendering scripts use
+    filename = os.path.basename(output_path)
+    x = wse['x'].values
+    y = wse['y'].values
+    return {
+        'file': filename,
+        'native_id': native_id,
+        'date': filename.split('_')[2],
+        'pass_tile': native_id.split('x_x_x_')[1].split('F')[0] if native_id else '_'.join(filename.split('_')[3:-1]),
+        'min': float(positive.min()) if positive.size else None,
+        'max': float(positive.max()) if positive.size else None,
+        'valid_count': int(np.count_nonzero(~np.isnan(values))),
+        'bounds': [float(x.min()), float(y.min()), float(x.max()), float(y.max())] if x.size and y.size else None,
+        'crs': wse.rio.crs.to_string() if wse.rio.crs is not None else None,
+    }
+
+
+def write_stats(output_path, stats):
+    """
+    Write the sidecar atomically so a reader never sees a half-written file.
+    """
+    path = sidecar_path(output_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+
+
+def load_index(netcdf_dir):
+    """
+    Read every sidecar in netcdf_dir once and return them keyed by the wse file name.
+    """
+    index = {}
+    if not os.path.isdir(netcdf_dir):
+        return index
+    for file in os.listdir(netcdf_dir):
+        if file.endswith(tuple(f'{ext}.json' for ext in output_extensions)):
+            try:
+                with open(os.path.join(netcdf_dir, file)) as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                continue
+            index[stats['file']] = stats
+    return index
+
+
+def file_stats(netcdf_dir, file, index):
+    """
+    Return the statistics of one filtered file from the index. Files written before the index
+    existed are scanned once and get their sidecar backfilled.
+    """
+    if file in index:
+        return index[file]
+    filepath = os.path.join(netcdf_dir, file)
+    with open_wse(filepath, decode_coords='all') as ds:
+        stats = compute_stats(ds['wse'].load(), filepath)
+    try:
+        write_stats(filepath, stats)
+    except OSError:
+        pass
+    index[file] = stats
+    return stats
+
+
+def global_min_max(netcdf_dir, files, index):
+    """
+    Combine the per-file positive min/max of a group of files without opening the rasters.
+    """
+    global_min = np.inf
+    global_max = -np.inf
+    for file in files:
+        try:
+            stats = file_stats(netcdf_dir, file, index)
+        except Exception as e:
+            print(f"Error reading statistics of {file}: {e}")
+            continue
+        if stats['min'] is None:
+            continue
+        global_min = min(global_min, stats['min'])
+        global_max = max(global_max, stats['max'])
+    return global_min, global_max
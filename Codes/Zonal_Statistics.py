@@ -0,0 +1,214 @@
+"""
+Per-zone WSE statistics (reservoirs, river reaches, ...) for every filtered granule.
+
+The zone polygons are rasterized once onto the 100 m UTM45 AOI grid (AOI_Grid.py) into a label
+index that is cached on disk. Each granule is then resampled onto the same grid and the count,
+mean, min, max, median and percentiles of every zone come from one sort of its valid pixels by
+zone, without looping over the polygons. Rows are appended to a CSV file, or written as one
+Parquet part file per granule (needs pyarrow), and granules already in the output are skipped.
+
+    python Zonal_Statistics.py --zones reservoirs.geojson --id-field name
+"""
+import os
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from affine import Affine
+from rasterio import features
+from AOI_Grid import AOIGrid
+from Output_Format import is_wse_output, open_wse
+
+netcdf_dir = '../Filtered_Data/'
+output_dir = '../Zonal_Stats/'
+geojson_file = 'east-bengal.geojson'
+
+
+class LabelIndex:
+    """
+    Zones rasterized on a grid, kept sparse: the sorted flat grid indices of the covered pixels
+    and the zone number (1-based, in the order of the polygons) of each. Where polygons overlap
+    the later one wins, so every pixel counts towards one zone.
+    """
+
+    def __init__(self, pixels, labels, zone_ids):
+        self.pixels = pixels
+        self.labels = labels
+        self.zone_ids = list(zone_ids)
+
+    @classmethod
+    def rasterize(cls, zones, grid, id_field=None):
+        zones = zones.to_crs(grid.crs)
+        zone_ids = zones[id_field].tolist() if id_field else zones.index.tolist()
+
+        # Only the window of the grid that the zones cover is rasterized
+        inverse = ~grid.transform
+        minx, miny, maxx, maxy = zones.total_bounds
+        col0, row0 = (int(np.floor(v)) for v in inverse * (minx, maxy))
+        col1, row1 = (int(np.ceil(v)) for v in inverse * (maxx, miny))
+        row0, col0 = max(row0, 0), max(col0, 0)
+        row1, col1 = min(row1, grid.shape[0]), min(col1, grid.shape[1])
+        if row1 <= row0 or col1 <= col0:
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), zone_ids)
+
+        shapes = [(geometry, label) for label, geometry in enumerate(zones.geometry, start=1)
+                  if geometry is not None and not geometry.is_empty]
+        window = features.rasterize(shapes, out_shape=(row1 - row0, col1 - col0), fill=0, dtype='int32',
+                                    transform=grid.transform * Affine.translation(col0, row0))
+        rows, cols = np.nonzero(window)
+        pixels = (rows + row0).astype(np.int64) * grid.shape[1] + (cols + col0)
+        return cls(pixels, window[rows, cols], zone_ids)
+
+    @classmethod
+    def cached(cls, zones_file, grid, id_field=None, cache_dir=os.path.join(output_dir, 'cache')):
+        """
+        Load the label index of a zones file from the cache, rasterizing it on a miss.
+        The cache key covers the zones file contents, the id field and the grid.
+        """
+        digest = hashlib.sha256()
+        with open(zones_file, 'rb') as f:
+            digest.update(f.read())
+        digest.update(f"{id_field}|{grid.crs}|{grid.shape}|{tuple(grid.transform)}".encode())
+        path = os.path.join(cache_dir, f"labels_{digest.hexdigest()[:16]}.npz")
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=True) as cache:
+                return cls(cache['pixels'], cache['labels'], cache['zone_ids'])
+
+        index = cls.rasterize(gpd.read_file(zones_file), grid, id_field)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, pixels=index.pixels, labels=index.labels, zone_ids=np.array(index.zone_ids, dtype=object))
+        os.replace(tmp_path, path)
+        return index
+
+    def lookup(self, flat_index):
+        """
+        Zone number of every flat grid index, 0 outside the zones.
+        """
+        if self.pixels.size == 0:
+            return np.zeros(flat_index.shape, dtype=np.int32)
+        position = np.minimum(np.searchsorted(self.pixels, flat_index), self.pixels.size - 1)
+        return np.where(self.pixels[position] == flat_index, self.labels[position], 0)
+
+
+def zonal_stats(labels, values, percentiles=(10, 25, 75, 90)):
+    """
+    Statistics per zone of the values with a positive label, in one sort.
+    Percentiles interpolate linearly between order statistics, like numpy's default.
+    Returns a DataFrame indexed by zone number with only the zones that have values.
+    """
+    keep = labels > 0
+    labels = labels[keep]
+    values = values[keep].astype(np.float64)
+    if labels.size == 0:
+        return pd.DataFrame()
+
+    order = np.lexsort((values, labels))
+    labels = labels[order]
+    values = values[order]
+    zones, start, count = np.unique(labels, return_index=True, return_counts=True)
+
+    stats = {
+        'count': count,
+        'mean': np.add.reduceat(values, start) / count,
+        'min': values[start],
+        'max': values[start + count - 1],
+    }
+    for name, q in [('median', 50)] + [(f'p{p:g}', p) for p in percentiles]:
+        position = start + (count - 1) * q / 100
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, start + count - 1)
+        stats[name] = values[low] + (values[high] - values[low]) * (position - low)
+    return pd.DataFrame(stats, index=pd.Index(zones, name='zone'))
+
+
+def granule_zonal_stats(path, grid, index, percentiles=(10, 25, 75, 90)):
+    """
+    Zonal statistics of one filtered file as rows ready to be appended.
+    """
+    with open_wse(path) as ds:
+        flat_index, values = grid.resample(ds['wse'])
+    stats = zonal_stats(index.lookup(flat_index), values, percentiles)
+    if stats.empty:
+        return stats
+    file = os.path.basename(path)
+    stats.insert(0, 'zone_id', [index.zone_ids[zone - 1] for zone in stats.index])
+    stats.insert(0, 'file', file)
+    stats.insert(0, 'date', pd.to_datetime(file.split('_')[2], format='%Y%m%d'))
+    return stats.reset_index(drop=True)
+
+
+def done_files(output_path, output_format):
+    """
+    Files whose statistics are already in the output.
+    """
+    if output_format == 'parquet':
+        if not os.path.isdir(output_path):
+            return set()
+        return {file[:-len('.parquet')] for file in os.listdir(output_path) if file.endswith('.parquet')}
+    if not os.path.exists(output_path):
+        return set()
+    return set(pd.read_csv(output_path, usecols=['file'])['file'])
+
+
+def append_stats(stats, output_path, output_format, file):
+    """
+    Append the rows of one file: to the CSV file, or as the Parquet part file <file>.parquet.
+    """
+    if output_format == 'parquet':
+        os.makedirs(output_path, exist_ok=True)
+        part = os.path.join(output_path, f"{file}.parquet")
+        stats.to_parquet(f"{part}.tmp", index=False)
+        os.replace(f"{part}.tmp", part)
+    else:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        stats.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False)
+
+
+def process_all_files(zones_file, id_field=None, output_path=None, output_format='csv',
+                      percentiles=(10, 25, 75, 90)):
+    """
+    Append the zonal statistics of every filtered file that is not in the output yet.
+    Files without any valid pixel in a zone get no rows but are remembered, so they are not re-read.
+    """
+    if output_path is None:
+        name = os.path.splitext(os.path.basename(zones_file))[0]
+        output_path = os.path.join(output_dir, f"{name}_wse.{'parquet' if output_format == 'parquet' else 'csv'}")
+
+    grid = AOIGrid.from_geojson(geojson_file)
+    index = LabelIndex.cached(zones_file, grid, id_field)
+    done = done_files(output_path, output_format)
+    empty_log = f"{output_path}.empty"
+    if os.path.exists(empty_log):
+        with open(empty_log) as f:
+            done.update(line.strip() for line in f)
+
+    for file in sorted(os.listdir(netcdf_dir)):
+        if not is_wse_output(file) or file in done:
+            continue
+        try:
+            stats = granule_zonal_stats(os.path.join(netcdf_dir, file), grid, index, percentiles)
+        except Exception as e:
+            print(f"Error processing {file}: {e}")
+            continue
+        if stats.empty:
+            with open(empty_log, 'a') as f:
+                f.write(f"{file}\n")
+            continue
+        append_stats(stats, output_path, output_format, file)
+        print(f"{file}: {len(stats)} zones")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zones', required=True, help="Polygon layer of the zones (GeoJSON, shapefile, ...).")
+    parser.add_argument('--id-field', default=None, help="Attribute that names the zones (default: row number).")
+    parser.add_argument('--output', default=None, help="Output CSV file or Parquet folder.")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="Output format.")
+    parser.add_argument('--percentiles', nargs='+', type=float, default=[10, 25, 75, 90],
+                        help="Percentiles reported next to the median.")
+    args = parser.parse_args()
+    path = process_all_files(args.zones, args.id_field, args.output, args.format, tuple(args.percentiles))
+    print(f"Zonal statistics in {path}")